@@ -1,55 +1,27 @@
 import json
 import os
 import re
-import uuid
 import ast
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import time
+import asyncio
+import threading
+from bisect import bisect_left
 
 import requests
-import certifi
-import urllib3
 from dotenv import load_dotenv
 
 load_dotenv()
 
-AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
 ACCESS_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
 API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
 
-TOKEN_CACHE = None
-
-CATEGORIES = ["Работа", "Учеба", "Личное", "Здоровье", "Покупки", "Встречи"]
-PRIORITIES = {"high", "medium", "low"}
-
-CATEGORY_KEYWORDS = {
-    "Работа": [
-        "работа", "проект", "встреча", "совещание", "бизнес", "офис", "коллеги", "начальник",
-        "отчет", "презентация", "дедлайн", "задача", "клиент", "контракт", "переговоры",
-    ],
-    "Учеба": [
-        "учеба", "урок", "экзамен", "лекция", "домашнее задание", "контрольная", "семинар",
-        "курс", "обучение", "школа", "университет", "студент", "преподаватель", "учитель",
-        "занятие", "пары",
-    ],
-    "Здоровье": [
-        "врач", "больница", "аптека", "здоровье", "мед", "прием", "осмотр", "анализ",
-        "спорт", "тренировка", "бег", "фитнес", "зал", "массаж", "стоматолог", "терапевт",
-        "поликлиника",
-    ],
-    "Покупки": [
-        "купить", "магазин", "покупки", "шопинг", "товары", "продукты", "супермаркет",
-        "аптека", "одежда", "еда", "заказать", "доставка",
-    ],
-    "Встречи": [
-        "встреча", "друг", "друзья", "семья", "родители", "дети", "поход", "кафе",
-        "кино", "театр", "концерт", "праздник", "день рождения", "свидание",
-    ],
-    "Личное": [
-        "личное", "дом", "быт", "уборка", "стирка", "ремонт", "счета", "платежи",
-        "документы", "паспорт", "банк", "почта", "звонок",
-    ],
-}
+AI_CONTEXT_WINDOW_DAYS = int(os.getenv("AI_CONTEXT_WINDOW_DAYS", "7"))
+AI_CONTEXT_MAX_EVENTS = int(os.getenv("AI_CONTEXT_MAX_EVENTS", "40"))
+AI_LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("AI_LOCAL_CONFIDENCE_THRESHOLD", "0.6"))
+
+_tier_lock = threading.Lock()
+_tier_counts: dict = {}
 
 def _today_with_weekday():
     now = datetime.now()
@@ -139,6 +111,31 @@ def _normalize_title(title: str) -> str:
     cleaned = title.strip()
     return cleaned[:1].upper() + cleaned[1:]
 
+try:
+    from backend.ai_client import gigachat_tokens, gigachat_breaker, post_chat, CircuitOpenError
+except Exception:
+    from ai_client import gigachat_tokens, gigachat_breaker, post_chat, CircuitOpenError
+
+try:
+    from backend.extraction_cache import extraction_cache
+except Exception:
+    from extraction_cache import extraction_cache
+
+try:
+    from backend.ai_prompt import format_existing_tasks
+except Exception:
+    from ai_prompt import format_existing_tasks
+
+try:
+    from backend.availability import AvailabilityIndex, WorkingHours, DEFAULT_HOURS, MIN_SLOT_MINUTES, working_hours_for
+except Exception:
+    from availability import AvailabilityIndex, WorkingHours, DEFAULT_HOURS, MIN_SLOT_MINUTES, working_hours_for
+
+try:
+    from backend.taxonomy import CATEGORIES, PRIORITIES, CATEGORY_KEYWORDS, TIME_PREFS_BY_CATEGORY, profile
+except Exception:
+    from taxonomy import CATEGORIES, PRIORITIES, CATEGORY_KEYWORDS, TIME_PREFS_BY_CATEGORY, profile
+
 try:
     from backend.ai_parser import local_parse as local_ai_parse
 except Exception:
@@ -313,6 +310,62 @@ def is_task_request(message: str) -> bool:
 
     return has_task_word or has_time_word
 
+def _record_tier(tier: str):
+    with _tier_lock:
+        _tier_counts[tier] = _tier_counts.get(tier, 0) + 1
+
+def tier_metrics() -> dict:
+    with _tier_lock:
+        counts = dict(_tier_counts)
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "counts": counts,
+        "ratios": {k: round(v / total, 3) for k, v in counts.items()} if total else {},
+    }
+
+def _processed_from_local(local: dict, user_text: str, ai_model: str, label: str = "") -> dict:
+    lf_date = local.get('date')
+    lf_time = local.get('time')
+    datetime_iso = None
+    if lf_time and lf_date:
+        datetime_iso = datetime.combine(lf_date, lf_time).isoformat()
+
+    return {
+        "title": _normalize_title(local.get('description')),
+        "description": f"Сгенерировано локальным парсером{label} из заметки: '{user_text}'",
+        "date": lf_date.isoformat() if lf_date else _today_with_weekday()[0].isoformat(),
+        "time": lf_time.strftime("%H:%M") if lf_time else None,
+        "datetime_iso": datetime_iso,
+        "category": local.get('category', 'Личное'),
+        "priority": local.get('priority', 'medium'),
+        "is_full_day_event": not bool(lf_time),
+        "metadata": {
+            "ai_model": ai_model,
+            "has_time": bool(lf_time),
+            "was_date_parsed": bool(local.get('signals', {}).get('date', True)),
+            "confidence_score": local.get('confidence')
+        }
+    }
+
+def _local_tier_response(local, user_text: str, base_response: dict, ai_model: str, warning: str, error: str) -> dict:
+    if not local:
+        base_response["error"] = error
+        return base_response
+    _record_tier(ai_model)
+    return {
+        "success": True,
+        "original_text": user_text,
+        "processed_task": _processed_from_local(local, user_text, ai_model),
+        "warnings": [warning],
+    }
+
+def _breaker_fallback(user_text: str, base_response: dict, local) -> dict:
+    return _local_tier_response(
+        local, user_text, base_response, "local_fallback_breaker",
+        "GigaChat временно недоступен, использован локальный парсер", "GigaChat временно недоступен"
+    )
+
 def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> dict:
     base_response = {
         "success": False,
@@ -321,46 +374,20 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
         "warnings": []
     }
 
+    local = None
     try:
-        local_fallback_quick = None
-        try:
-            local_fallback_quick = local_ai_parse(user_text)
-        except Exception:
-            local_fallback_quick = None
-
-        if local_fallback_quick:
-            lf_date = local_fallback_quick.get('date')
-            lf_time = local_fallback_quick.get('time')
-            datetime_iso = None
-            if lf_time and lf_date:
-                datetime_iso = datetime.combine(lf_date, lf_time).isoformat()
-
-            processed_task = {
-                "title": _normalize_title(local_fallback_quick.get('description')),
-                "description": f"Сгенерировано локальным парсером (instant) из заметки: '{user_text}'",
-                "date": lf_date.isoformat() if lf_date else _today_with_weekday()[0].isoformat(),
-                "time": lf_time.strftime("%H:%M") if lf_time else None,
-                "datetime_iso": datetime_iso,
-                "category": local_fallback_quick.get('category', 'Личное'),
-                "priority": local_fallback_quick.get('priority', 'medium'),
-                "is_full_day_event": not bool(lf_time),
-                "metadata": {
-                    "ai_model": "local_fallback_instant",
-                    "has_time": bool(lf_time),
-                    "was_date_parsed": True,
-                    "confidence_score": None
-                }
-            }
-
-            return {
-                "success": True,
-                "original_text": user_text,
-                "processed_task": processed_task,
-                "warnings": ["Использован локальный парсер (instant, без ожидания сети)"],
-            }
+        local = local_ai_parse(user_text) if local_ai_parse else None
     except Exception:
+        local = None
 
-        pass
+    if local and local['signals']['time'] and (local.get('confidence') or 0) >= AI_LOCAL_CONFIDENCE_THRESHOLD:
+        _record_tier("local_parse")
+        return {
+            "success": True,
+            "original_text": user_text,
+            "processed_task": _processed_from_local(local, user_text, "local_parse", " (instant)"),
+            "warnings": ["Использован локальный парсер (instant, без ожидания сети)"],
+        }
 
     try:
         txt_low = (user_text or "").strip().lower()
@@ -385,24 +412,29 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
         except Exception:
             pass
 
-    try:
-        load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
-    except Exception:
-
-        try:
-            load_dotenv()
-        except Exception:
-            pass
+    cached = extraction_cache.get(user_text)
+    if cached is not None:
+        processed_task = cached["processed_task"]
+        processed_task["description"] = f"Сгенерировано из заметки: '{user_text}'"
+        processed_task["metadata"]["ai_model"] = "GigaChat-cache"
+        _record_tier("GigaChat-cache")
+        return {
+            "success": True,
+            "original_text": user_text,
+            "processed_task": processed_task,
+            "warnings": cached["warnings"],
+            "cached": True
+        }
 
-    global AUTHORIZATION_KEY
-    AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
-    global TOKEN_CACHE
-    TOKEN_CACHE = None
+    if gigachat_breaker.is_open():
+        return _breaker_fallback(user_text, base_response, local)
 
     token = get_token()
     if not token:
-        base_response["error"] = "ИИ помощник не настроен"
-        return base_response
+        return _local_tier_response(
+            local, user_text, base_response, "local_fallback",
+            "Использован локальный парсер (fallback)", "ИИ помощник не настроен"
+        )
 
     try:
 
@@ -418,38 +450,26 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
             try:
                 prompt = _build_gigachat_prompt(user_text)
                 if existing_tasks:
-                    prompt += "\n\nExisting tasks:\n" + str(existing_tasks)
+                    prompt += "\n\nExisting tasks:\n" + format_existing_tasks(existing_tasks)
             except Exception:
                 prompt = _build_gigachat_prompt(user_text)
-        def _safe_post(url, **kwargs):
-            kw = kwargs.copy()
-            if 'verify' not in kw:
-                kw['verify'] = certifi.where()
-            try:
-                return requests.post(url, **kw)
-            except requests.exceptions.SSLError:
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                kw['verify'] = False
-                return requests.post(url, **kw)
-
         start = time.time()
-        r = _safe_post(
-            API_URL,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "GigaChat",
-                "messages": [
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": user_text}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 300
-            },
-            timeout=(3, 8)
-        )
+        try:
+            r = post_chat(
+                token,
+                {
+                    "model": "GigaChat",
+                    "messages": [
+                        {"role": "system", "content": prompt},
+                        {"role": "user", "content": user_text}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": 300
+                },
+                timeout=(3, 8)
+            )
+        except CircuitOpenError:
+            return _breaker_fallback(user_text, base_response, local)
         elapsed = time.time() - start
         if elapsed > 5:
             try:
@@ -480,8 +500,12 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
             pass
 
         if r.status_code != 200:
-            base_response["error"] = f"Ошибка API GigaChat (код {r.status_code})"
-            return base_response
+            if r.status_code == 401:
+                gigachat_tokens.invalidate()
+            return _local_tier_response(
+                local, user_text, base_response, "local_fallback",
+                "Использован локальный парсер (fallback)", f"Ошибка API GigaChat (код {r.status_code})"
+            )
 
         response_data = r.json()
         if "choices" not in response_data or not response_data["choices"]:
@@ -536,36 +560,9 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
         ok, processed_task, warnings = _validate_and_enrich(parsed_json, user_text)
 
         if not ok:
-            local_fallback = None
-            try:
-                local_fallback = local_ai_parse(user_text)
-            except Exception:
-                local_fallback = None
-
-            if local_fallback:
-
-                lf_date = local_fallback.get('date')
-                lf_time = local_fallback.get('time')
-                datetime_iso = None
-                if lf_time:
-                    datetime_iso = datetime.combine(lf_date, lf_time).isoformat()
-
-                processed_task = {
-                    "title": _normalize_title(local_fallback.get('description')),
-                    "description": f"Сгенерировано локальным парсером из заметки: '{user_text}'",
-                    "date": lf_date.isoformat() if lf_date else _today_with_weekday()[0].isoformat(),
-                    "time": lf_time.strftime("%H:%M") if lf_time else None,
-                    "datetime_iso": datetime_iso,
-                    "category": local_fallback.get('category', 'Личное'),
-                    "priority": local_fallback.get('priority', 'medium'),
-                    "is_full_day_event": not bool(lf_time),
-                    "metadata": {
-                        "ai_model": "local_fallback",
-                        "has_time": bool(lf_time),
-                        "was_date_parsed": True,
-                        "confidence_score": None
-                    }
-                }
+            if local:
+
+                processed_task = _processed_from_local(local, user_text, "local_fallback")
 
                 warnings.append("Использован локальный парсер (fallback)")
                 ok = True
@@ -592,14 +589,7 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
                     conv = post_conversation(user_text)
                     if conv.get('success') and conv.get('raw'):
 
-                        return {
-                            'success': True,
-                            'original_text': user_text,
-                            'processed_task': None,
-                            'warnings': [],
-                            'type': 'text',
-                            'content': conv.get('raw')
-                        }
+                        return _conversation_reply(user_text, conv)
                     else:
                         base_response["raw_model"] = raw_content
                         try:
@@ -656,114 +646,61 @@ def extract_task_via_gigachat(user_text: str, existing_tasks: list = None) -> di
                 base_response["error"] = "Не удалось разобрать ответ модели"
                 return base_response
 
+        ai_model = processed_task["metadata"].get("ai_model")
+        _record_tier(ai_model)
+        if ai_model == "GigaChat":
+            extraction_cache.put(user_text, {"processed_task": processed_task, "warnings": warnings})
+
         return base_response
     except requests.exceptions.RequestException as exc:
-        base_response["error"] = f"Ошибка соединения с GigaChat: {exc}"
-        return base_response
+        return _local_tier_response(
+            local, user_text, base_response, "local_fallback",
+            "Использован локальный парсер (fallback)", f"Ошибка соединения с GigaChat: {exc}"
+        )
     except Exception as exc:
         base_response["error"] = f"Ошибка при обработке запроса: {exc}"
         return base_response
 
-def get_free_slots_for_date(date, existing_events):
+def get_free_slots_for_date(date, existing_events, hours: WorkingHours = DEFAULT_HOURS, index: AvailabilityIndex = None):
     
 
-    work_start = datetime.combine(date, datetime.strptime("09:00", "%H:%M").time())
-    work_end = datetime.combine(date, datetime.strptime("18:00", "%H:%M").time())
-
-    sorted_events = sorted(existing_events, key=lambda x: x.start_time)
-
-    free_slots = []
-    current_time = work_start
-
-    for event in sorted_events:
-        event_start = event.start_time
-        event_end = event.end_time or event.start_time
+    index = index or AvailabilityIndex(existing_events, hours.buffer_minutes)
+    work_start, work_end = hours.window(date)
 
-        if event_start > current_time:
-            slot_duration = (event_start - current_time).total_seconds() / 3600
-            if slot_duration >= 0.5:
-                free_slots.append({
-                    'start': current_time,
-                    'end': event_start,
-                    'duration_hours': slot_duration
-                })
+    return [
+        {
+            'start': slot_start,
+            'end': slot_end,
+            'duration_hours': (slot_end - slot_start).total_seconds() / 3600
+        }
+        for slot_start, slot_end in index.free_slots(work_start, work_end, hours=hours)
+    ]
 
-        current_time = max(current_time, event_end)
+def auto_assign_category(title: str, description: str = "") -> str:
+    return profile(f"{title or ''} {description or ''}").category
 
-    if current_time < work_end:
-        slot_duration = (work_end - current_time).total_seconds() / 3600
-        if slot_duration >= 0.5:
-            free_slots.append({
-                'start': current_time,
-                'end': work_end,
-                'duration_hours': slot_duration
-            })
+def auto_assign_categories(pairs) -> list[str]:
+    return [profile(f"{title or ''} {description or ''}").category for title, description in pairs]
 
-    return free_slots
+def time_category(description: str) -> str:
+    return profile(description).time_category
 
-def auto_assign_category(title: str, description: str = "") -> str:
+def suggest_optimal_time(date, description, existing_events, priority: str = "medium", hours: WorkingHours = DEFAULT_HOURS):
     
-    text = f"{title} {description}".lower().strip()
-
-    if not text:
-        return "Личное"
-
-    scores: dict[str, int] = {}
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        score = 0
-        for keyword in keywords:
-            kw = keyword.lower()
-            if not kw:
-                continue
-
-            score += text.count(kw)
-            if f" {kw} " in f" {text} ":
-                score += 2
-        scores[category] = score
-
-    best_category, best_score = max(scores.items(), key=lambda x: x[1])
-    if best_score <= 0:
-        return "Личное"
-    return best_category
-
-def suggest_optimal_time(date, description, existing_events, priority: str = "medium"):
-    
-    return suggest_optimal_time_with_exclusions(date, description, existing_events, priority, [])
+    return suggest_optimal_time_with_exclusions(date, description, existing_events, priority, [], hours=hours)
 
-def suggest_optimal_time_with_exclusions(date, description, existing_events, priority: str = "medium", exclude_times: list = None):
+def suggest_optimal_time_with_exclusions(date, description, existing_events, priority: str = "medium", exclude_times: list = None,
+                                         hours: WorkingHours = DEFAULT_HOURS):
     
     if exclude_times is None:
         exclude_times = []
 
-    free_slots = get_free_slots_for_date(date, existing_events)
+    index = AvailabilityIndex(existing_events, hours.buffer_minutes)
+    free_slots = get_free_slots_for_date(date, existing_events, hours=hours, index=index)
     if not free_slots:
         return None
 
-    event_type = (description or "").lower()
-
-    time_prefs_by_category = {
-        "work": [9, 10, 11, 14, 15, 16],
-        "lunch": [12, 13, 14],
-        "sport": [7, 8, 18, 19, 20],
-        "health": [9, 10, 11, 17, 18],
-        "shopping": [11, 12, 17, 18, 19],
-        "personal": [10, 11, 17, 18, 19],
-    }
-
-    if any(w in event_type for w in ["встреча", "совещание", "митинг", "meeting", "работа", "проект", "бизнес"]):
-        category = "work"
-    elif any(w in event_type for w in ["обед", "перерыв", "пауза", "кушать", "поесть"]):
-        category = "lunch"
-    elif any(w in event_type for w in ["спорт", "тренировка", "бег", "фитнес", "зал", "пробежка"]):
-        category = "sport"
-    elif any(w in event_type for w in ["врач", "больница", "аптека", "здоровье", "мед"]):
-        category = "health"
-    elif any(w in event_type for w in ["купить", "магазин", "покупки", "шопинг"]):
-        category = "shopping"
-    else:
-        category = "personal"
-
-    preferred_hours = time_prefs_by_category[category]
+    preferred_hours = TIME_PREFS_BY_CATEGORY[time_category(description)]
 
     exclude_datetimes = []
     for time_str in exclude_times:
@@ -773,27 +710,39 @@ def suggest_optimal_time_with_exclusions(date, description, existing_events, pri
                 exclude_datetimes.append(datetime.combine(date, datetime.strptime(f"{hour:02d}:{minute:02d}", "%H:%M").time()))
         except Exception:
             pass
+    exclude_datetimes.sort()
 
-    candidates = []
+    def _excluded(candidate):
+        i = bisect_left(exclude_datetimes, candidate)
+        return any(
+            abs((candidate - exclude_datetimes[j]).total_seconds()) < 1800
+            for j in (i - 1, i) if 0 <= j < len(exclude_datetimes)
+        )
 
-    for slot in free_slots:
-        start_hour = slot["start"].hour
-        end_hour = slot["end"].hour
-        for h in preferred_hours:
-            if start_hour <= h < end_hour:
-                candidate = datetime.combine(date, datetime.strptime(f"{h:02d}:00", "%H:%M").time())
+    slot_length = timedelta(minutes=MIN_SLOT_MINUTES)
+    work_start, work_end = hours.window(date)
 
-                if not any(abs((candidate - excl).total_seconds()) < 1800 for excl in exclude_datetimes):
-                    candidates.append(candidate)
+    def _usable(candidate):
+        return (
+            work_start <= candidate and candidate + slot_length <= work_end
+            and index.is_free(candidate, candidate + slot_length)
+            and not _excluded(candidate)
+        )
+
+    candidates = [
+        candidate
+        for candidate in (datetime.combine(date, datetime.min.time()) + timedelta(hours=h) for h in preferred_hours)
+        if _usable(candidate)
+    ]
 
     if not candidates:
         for slot in free_slots:
             current = slot["start"]
-            while current < slot["end"]:
+            while current + slot_length <= slot["end"]:
 
-                if not any(abs((current - excl).total_seconds()) < 1800 for excl in exclude_datetimes):
+                if not _excluded(current):
                     candidates.append(current)
-                current += timedelta(minutes=30)
+                current += slot_length
                 if len(candidates) >= 10:
                     break
             if len(candidates) >= 10:
@@ -814,85 +763,94 @@ def suggest_optimal_time_with_exclusions(date, description, existing_events, pri
     return best
 
 def get_token():
-    global TOKEN_CACHE
-    if TOKEN_CACHE:
-        return TOKEN_CACHE
-
-    if not AUTHORIZATION_KEY or AUTHORIZATION_KEY == "YOUR_GIGACHAT_AUTH_KEY_HERE":
-        return None
-
-    try:
-        rquid = str(uuid.uuid4())
-        try:
-            r = requests.post(
-                ACCESS_URL,
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json",
-                    "RqUID": rquid,
-                    "Authorization": f"Bearer {AUTHORIZATION_KEY}"
-                },
-                data={"scope": "GIGACHAT_API_PERS"},
-                verify=certifi.where(),
-                timeout=10
-            )
-        except requests.exceptions.SSLError:
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            r = requests.post(
-                ACCESS_URL,
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json",
-                    "RqUID": rquid,
-                    "Authorization": f"Bearer {AUTHORIZATION_KEY}"
-                },
-                data={"scope": "GIGACHAT_API_PERS"},
-                verify=False,
-                timeout=10
-            )
-
-        if r.status_code != 200:
-            return None
+    return gigachat_tokens.get_token()
 
-        response_data = r.json()
-        TOKEN_CACHE = response_data.get("access_token")
-        if not TOKEN_CACHE:
-            return None
+def _conversation_reply(message: str, conv) -> dict:
+    if conv is None:
+        content = 'Произошла ошибка при обработке сообщения.'
+    elif conv.get('success') and conv.get('raw'):
+        content = conv.get('raw')
+    else:
+        content = 'Извините, я не смог обработать ваш запрос. Попробуйте переформулировать.'
+    _record_tier("conversation")
+    return {
+        'success': True,
+        'original_text': message,
+        'processed_task': None,
+        'warnings': [],
+        'type': 'text',
+        'content': content,
+        'tier': 'conversation'
+    }
 
-        return TOKEN_CACHE
-    except Exception:
-        return None
+def _events_on_day(db_session, user_id, target_date):
+    from backend.database import Event
+    return db_session.query(Event.id, Event.title, Event.start_time, Event.end_time).filter(
+        Event.user_id == user_id,
+        Event.start_time >= datetime.combine(target_date, datetime.min.time()),
+        Event.start_time < datetime.combine(target_date + timedelta(days=1), datetime.min.time())
+    ).order_by(Event.start_time).all()
+
+def select_context_events(db_session, user_id, now=None, window_days: int = AI_CONTEXT_WINDOW_DAYS,
+                          limit: int = AI_CONTEXT_MAX_EVENTS) -> list:
+    from backend.database import Event
+    now = now or datetime.now()
+    columns = (Event.id, Event.title, Event.start_time, Event.end_time, Event.source, Event.external_id)
+
+    upcoming = db_session.query(*columns).filter(
+        Event.user_id == user_id,
+        Event.start_time >= now,
+        Event.start_time < now + timedelta(days=window_days)
+    ).order_by(Event.start_time).limit(limit).all()
+
+    recent = db_session.query(*columns).filter(
+        Event.user_id == user_id,
+        Event.start_time < now,
+        Event.start_time >= now - timedelta(days=window_days)
+    ).order_by(Event.start_time.desc()).limit(max(1, limit // 4)).all()
+
+    return [
+        {
+            'id': e.id,
+            'title': e.title,
+            'start': e.start_time.isoformat() if e.start_time else None,
+            'end': e.end_time.isoformat() if e.end_time else None,
+            'source': e.source,
+            'external_id': e.external_id
+        }
+        for e in sorted(recent + upcoming, key=lambda e: e.start_time)
+    ]
 
 def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
     
 
-    load_dotenv()
-    global AUTHORIZATION_KEY
-    AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
-
-    global TOKEN_CACHE
-    TOKEN_CACHE = None
-
     if db_session and user_id:
 
         if not is_task_request(message):
 
             pass
         else:
+            from backend.batch_scheduler import plan_message, plan_summary
+            batch = plan_message(db_session, user_id, message)
+            if batch:
+                _record_tier("batch_plan")
+                return {
+                    'type': 'batch_proposal',
+                    'content': plan_summary(batch),
+                    'plan': batch,
+                    'needs_confirmation': True
+                }
+
             event_request = parse_event_request(message)
             if event_request:
 
                 target_date = event_request['date']
                 description = event_request['description']
 
-                from backend.database import Event
-                existing_events = db_session.query(Event).filter(
-                    Event.user_id == user_id,
-                    Event.start_time >= datetime.combine(target_date, datetime.min.time()),
-                    Event.start_time < datetime.combine(target_date + timedelta(days=1), datetime.min.time())
-                ).all()
+                existing_events = _events_on_day(db_session, user_id, target_date)
 
-                suggested_time = suggest_optimal_time(target_date, description, existing_events)
+                hours = working_hours_for(db_session, user_id)
+                suggested_time = suggest_optimal_time(target_date, description, existing_events, hours=hours)
 
                 if suggested_time:
                     return {
@@ -901,7 +859,7 @@ def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
                             'date': target_date,
                             'description': description,
                             'suggested_time': suggested_time,
-                            'free_slots_count': len(get_free_slots_for_date(target_date, existing_events))
+                            'free_slots_count': len(get_free_slots_for_date(target_date, existing_events, hours=hours))
                         }
                     }
                 else:
@@ -910,24 +868,6 @@ def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
                         'content': f"Извините, на {target_date.strftime('%d.%m.%Y')} нет свободного времени для события '{description}'. Попробуйте выбрать другую дату."
                     }
 
-    existing_tasks = None
-    if db_session is not None and user_id is not None:
-        try:
-            from backend.database import Event
-            evs = db_session.query(Event).filter(Event.user_id == user_id).all()
-            existing_tasks = []
-            for e in evs:
-                existing_tasks.append({
-                    'id': e.id,
-                    'title': e.title,
-                    'start': e.start_time.isoformat() if e.start_time else None,
-                    'end': e.end_time.isoformat() if e.end_time else None,
-                    'source': e.source,
-                    'external_id': e.external_id
-                })
-        except Exception:
-            existing_tasks = None
-
     if not is_task_request(message):
 
         try:
@@ -937,35 +877,16 @@ def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
             except Exception:
                 from ai_client import post_conversation
 
-            conv = post_conversation(message)
-            if conv.get('success') and conv.get('raw'):
-
-                return {
-                    'success': True,
-                    'original_text': message,
-                    'processed_task': None,
-                    'warnings': [],
-                    'type': 'text',
-                    'content': conv.get('raw')
-                }
-            else:
-                return {
-                    'success': True,
-                    'original_text': message,
-                    'processed_task': None,
-                    'warnings': [],
-                    'type': 'text',
-                    'content': 'Извините, я не смог обработать ваш запрос. Попробуйте переформулировать.'
-                }
+            return _conversation_reply(message, post_conversation(message))
         except Exception as e:
-            return {
-                'success': True,
-                'original_text': message,
-                'processed_task': None,
-                'warnings': [],
-                'type': 'text',
-                'content': 'Произошла ошибка при обработке сообщения.'
-            }
+            return _conversation_reply(message, None)
+
+    existing_tasks = None
+    if db_session is not None and user_id is not None:
+        try:
+            existing_tasks = select_context_events(db_session, user_id)
+        except Exception:
+            existing_tasks = None
 
     structured = extract_task_via_gigachat(message, existing_tasks=existing_tasks)
 
@@ -983,7 +904,10 @@ def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
                 if date_str:
                     date_obj = _dt.fromisoformat(date_str).date()
 
-                    suggested = suggest_optimal_time(date_obj, desc, evs if 'evs' in locals() else [], priority)
+                    suggested = suggest_optimal_time(
+                        date_obj, desc, _events_on_day(db_session, user_id, date_obj), priority,
+                        hours=working_hours_for(db_session, user_id)
+                    )
                     if suggested:
                         suggested_time = suggested.strftime('%H:%M')
         except Exception:
@@ -1021,3 +945,27 @@ def ask_gigachat(message: str, db_session=None, user_id=None) -> dict:
         'content': error_msg,
         'structured': structured
     }
+
+def _ask_gigachat_with_session(message: str, user_id=None) -> dict:
+    from backend.database import SessionLocal
+    db = SessionLocal()
+    try:
+        return ask_gigachat(message, db_session=db, user_id=user_id)
+    finally:
+        db.close()
+
+async def ask_gigachat_async(message: str, user_id=None) -> dict:
+    try:
+        from backend.ai_client import apost_conversation, run_limited
+    except Exception:
+        from ai_client import apost_conversation, run_limited
+
+    if not is_task_request(message):
+        try:
+            return _conversation_reply(message, await apost_conversation(message))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return _conversation_reply(message, None)
+
+    return await run_limited(_ask_gigachat_with_session, message, user_id)
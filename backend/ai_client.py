@@ -1,16 +1,33 @@
 import json
 import os
+import asyncio
 import time
 import uuid
 import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import Optional
 
 import requests
 import certifi
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
 try:
     from .ai_prompt import build_gigachat_prompt
 except Exception:
@@ -30,23 +47,43 @@ API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
-_CACHED_TOKEN = None
-_TOKEN_EXPIRES_AT = 0.0
+TOKEN_REFRESH_MARGIN = float(os.getenv('GIGACHAT_TOKEN_REFRESH_MARGIN', '60'))
+
+GIGACHAT_POOL_SIZE = int(os.getenv('GIGACHAT_POOL_SIZE', '20'))
+GIGACHAT_MAX_CONCURRENCY = int(os.getenv('GIGACHAT_MAX_CONCURRENCY', '8'))
+
+GIGACHAT_BREAKER_THRESHOLD = int(os.getenv('GIGACHAT_BREAKER_THRESHOLD', '5'))
+GIGACHAT_BREAKER_RESET_SECONDS = float(os.getenv('GIGACHAT_BREAKER_RESET_SECONDS', '30'))
+GIGACHAT_HEDGE = os.getenv('GIGACHAT_HEDGE', '0').lower() in ('1', 'true', 'yes')
+GIGACHAT_HEDGE_QUANTILE = float(os.getenv('GIGACHAT_HEDGE_QUANTILE', '0.95'))
+GIGACHAT_HEDGE_MIN_SAMPLES = int(os.getenv('GIGACHAT_HEDGE_MIN_SAMPLES', '20'))
+
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=GIGACHAT_POOL_SIZE, max_retries=0))
+
+_tls_verify: dict = {}
 
 def _safe_post(url, **kwargs):
-    kwargs2 = kwargs.copy()
-    if 'verify' not in kwargs2:
-        kwargs2['verify'] = certifi.where()
+    if 'verify' in kwargs:
+        return _http.post(url, **kwargs)
+
+    host = urlsplit(url).netloc
+    verify = _tls_verify.get(host, certifi.where())
     try:
-        return requests.post(url, **kwargs2)
+        r = _http.post(url, verify=verify, **kwargs)
+        _tls_verify.setdefault(host, verify)
+        return r
     except requests.exceptions.SSLError:
+        if verify is False:
+            raise
+        logger.warning('TLS verification failed for %s, falling back to verify=False', host)
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        kwargs2['verify'] = False
-        return requests.post(url, **kwargs2)
+        _tls_verify[host] = False
+        return _http.post(url, verify=False, **kwargs)
 
 def get_token_from_env() -> Optional[dict]:
     auth_key = os.getenv('GIGACHAT_AUTHORIZATION_KEY')
-    if not auth_key:
+    if not auth_key or auth_key == "YOUR_GIGACHAT_AUTH_KEY_HERE":
         return None
     try:
         rquid = str(uuid.uuid4())
@@ -76,20 +113,262 @@ def get_token_from_env() -> Optional[dict]:
         logger.exception('get_token_from_env failed: %s', exc)
         return None
 
+class TokenManager:
+    def __init__(self, fetch=None, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self._fetch = fetch or get_token_from_env
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._last_used = 0.0
+        self._timer: Optional[threading.Timer] = None
+
+    def _is_fresh(self, now: float) -> bool:
+        return bool(self._token) and self._expires_at > now + 5
+
+    @staticmethod
+    def _expiry_from(info: dict, now: float) -> float:
+        expires_at = info.get('expires_at')
+        if expires_at:
+            expires_at = float(expires_at)
+            return expires_at / 1000.0 if expires_at > 1e11 else expires_at
+        return now + int(info.get('expires_in') or 1800)
+
+    def get_token(self) -> Optional[str]:
+        now = time.time()
+        self._last_used = now
+        if self._is_fresh(now):
+            return self._token
+        with self._lock:
+            if self._is_fresh(time.time()):
+                return self._token
+            return self._refresh_locked()
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def _refresh_locked(self) -> Optional[str]:
+        info = self._fetch()
+        if not info:
+            return None
+        token = info.get('access_token') or info.get('token')
+        if not token:
+            return None
+
+        fetched_at = time.time()
+        self._token = token
+        self._expires_at = self._expiry_from(info, fetched_at)
+        self._schedule_refresh(fetched_at)
+        return token
+
+    def _schedule_refresh(self, fetched_at: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._expires_at - fetched_at - self.refresh_margin, 1.0)
+        self._timer = threading.Timer(delay, self._background_refresh, args=(fetched_at,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self, fetched_at: float):
+        if self._last_used < fetched_at:
+            return
+        with self._lock:
+            try:
+                self._refresh_locked()
+            except Exception as exc:
+                logger.exception('Background GigaChat token refresh failed: %s', exc)
+
+gigachat_tokens = TokenManager()
+
 def _get_cached_token() -> Optional[str]:
-    global _CACHED_TOKEN, _TOKEN_EXPIRES_AT
-    now = time.time()
-    if _CACHED_TOKEN and _TOKEN_EXPIRES_AT > now + 5:
-        return _CACHED_TOKEN
-    info = get_token_from_env()
-    if not info:
+    return gigachat_tokens.get_token()
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = GIGACHAT_BREAKER_THRESHOLD,
+                 reset_timeout: float = GIGACHAT_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._short_circuited = 0
+        self._transitions: dict = {}
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def is_open(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.reset_timeout
+            return self._state == self.HALF_OPEN and self._probe_in_flight
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def release_probe(self):
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _transition(self, new_state: str):
+        key = f'{self._state}->{new_state}'
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        logger.warning('Circuit %s: %s', self.name, key)
+        self._state = new_state
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'short_circuited': self._short_circuited,
+                'transitions': dict(self._transitions),
+            }
+
+gigachat_breaker = CircuitBreaker('gigachat')
+
+_latencies: deque = deque(maxlen=200)
+_hedge_stats = {'sent': 0, 'won': 0}
+_hedge_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=GIGACHAT_POOL_SIZE, thread_name_prefix='gigachat-hedge')
+
+def _hedge_delay() -> Optional[float]:
+    if not GIGACHAT_HEDGE:
         return None
+    with _hedge_lock:
+        if len(_latencies) < GIGACHAT_HEDGE_MIN_SAMPLES:
+            return None
+        values = sorted(_latencies)
+    return values[min(len(values) - 1, int(GIGACHAT_HEDGE_QUANTILE * len(values)))]
 
-    token = info.get('access_token') or info.get('token')
-    expires = int(info.get('expires_in') or 3600)
-    _CACHED_TOKEN = token
-    _TOKEN_EXPIRES_AT = now + expires
-    return _CACHED_TOKEN
+def _record_latency(seconds: float):
+    with _hedge_lock:
+        _latencies.append(seconds)
+
+def _count_hedge(key: str):
+    with _hedge_lock:
+        _hedge_stats[key] += 1
+
+def _spawn(fn, *args, **kwargs) -> Future:
+    fut = Future()
+
+    def run():
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            fut.set_exception(exc)
+
+    threading.Thread(target=run, name='gigachat-primary', daemon=True).start()
+    return fut
+
+def _post_hedged(url, **kwargs):
+    delay = _hedge_delay()
+    if delay is None:
+        return _safe_post(url, **kwargs)
+
+    first = _spawn(_safe_post, url, **kwargs)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    _count_hedge('sent')
+    second = _hedge_pool.submit(_safe_post, url, **kwargs)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                if fut is second:
+                    _count_hedge('won')
+                return fut.result()
+            error = fut.exception()
+    raise error
+
+def _is_breaker_failure(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+def post_chat(token: str, payload: dict, timeout=(3, 8)):
+    if not gigachat_breaker.allow():
+        raise CircuitOpenError('GigaChat circuit is open')
+    start = time.monotonic()
+    try:
+        r = _post_hedged(
+            API_URL,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            json=payload,
+            timeout=timeout
+        )
+    except requests.exceptions.RequestException:
+        gigachat_breaker.record_failure()
+        raise
+    except BaseException:
+        gigachat_breaker.release_probe()
+        raise
+    if _is_breaker_failure(r.status_code):
+        gigachat_breaker.record_failure()
+    else:
+        gigachat_breaker.record_success()
+        if r.status_code == 200:
+            _record_latency(time.monotonic() - start)
+    return r
+
+def client_metrics() -> dict:
+    delay = _hedge_delay()
+    with _hedge_lock:
+        stats = dict(_hedge_stats)
+    return {
+        'breaker': gigachat_breaker.metrics(),
+        'hedge': {
+            'enabled': GIGACHAT_HEDGE,
+            'delay_s': round(delay, 3) if delay is not None else None,
+            **stats,
+        },
+    }
 
 def _extract_content_from_response(r):
     try:
@@ -112,15 +391,7 @@ def _do_request_with_payload(payload, max_attempts=2, timeout=8, slow_label='Gig
         attempt += 1
         try:
             start = time.time()
-            r = _safe_post(
-                API_URL,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-                timeout=(3, timeout)
-            )
+            r = post_chat(token, payload, timeout=(3, timeout))
             elapsed = time.time() - start
             if elapsed > 5:
                 logger.warning('Slow %s request: %.2fs (attempt %s)', slow_label, elapsed, attempt)
@@ -132,54 +403,165 @@ def _do_request_with_payload(payload, max_attempts=2, timeout=8, slow_label='Gig
                 return {'success': True, 'raw': content, 'response': data}
 
             last_err = f'HTTP {r.status_code}'
+            if r.status_code == 401:
+                gigachat_tokens.invalidate()
+                token = _get_cached_token()
+                if token:
+                    continue
             if r.status_code in (429, 500, 502, 503, 504):
+                if gigachat_breaker.is_open():
+                    break
                 time.sleep(attempt * 1.0)
                 continue
             return {'success': False, 'error': f'Ошибка API GigaChat (код {r.status_code})', 'raw': r.text}
+        except CircuitOpenError:
+            return {'success': False, 'error': 'GigaChat временно недоступен', 'raw': None, 'circuit_open': True}
         except requests.exceptions.RequestException as exc:
             last_err = str(exc)
             logger.exception('RequestException on GigaChat request: %s', exc)
+            if gigachat_breaker.is_open():
+                break
             time.sleep(attempt * 0.5)
             continue
     return {'success': False, 'error': f'Ошибка соединения с GigaChat: {last_err}', 'raw': None}
 
-def post_to_gigachat(user_text: str, max_attempts: int = 2, timeout: int = 8):
-    prompt = build_gigachat_prompt(user_text) if build_gigachat_prompt else ''
-    payload = {
+def _chat_payload(system_prompt: str, user_text: str) -> dict:
+    return {
         "model": "GigaChat",
         "messages": [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_text}
         ],
         "temperature": 0.0,
         "max_tokens": 300
     }
+
+CONVERSATION_SYSTEM_PROMPT = (
+    "Ты — дружелюбный и полезный ассистент. Отвечай на вопросы пользователя понятно и кратко."
+    " Отвечай на русском языке. Никогда не добавляй служебный текст, просто ответ пользователя."
+)
+
+def post_to_gigachat(user_text: str, max_attempts: int = 2, timeout: int = 8):
+    prompt = build_gigachat_prompt(user_text) if build_gigachat_prompt else ''
+    payload = _chat_payload(prompt, user_text)
     return _do_request_with_payload(payload, max_attempts=max_attempts, timeout=timeout, slow_label='GigaChat')
 
 def post_conversation(user_text: str, max_attempts: int = 2, timeout: int = 8):
-    system_prompt = (
-        "Ты — дружелюбный и полезный ассистент. Отвечай на вопросы пользователя понятно и кратко."
-        " Отвечай на русском языке. Никогда не добавляй служебный текст, просто ответ пользователя."
-    )
-    payload = {
-        "model": "GigaChat",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_text}
-        ],
-        "temperature": 0.0,
-        "max_tokens": 300
-    }
+    payload = _chat_payload(CONVERSATION_SYSTEM_PROMPT, user_text)
     return _do_request_with_payload(payload, max_attempts=max_attempts, timeout=timeout, slow_label='GigaChat-conv')
 
 def post_custom(system_prompt: str, user_text: str, max_attempts: int = 2, timeout: int = 8):
-    payload = {
-        "model": "GigaChat",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_text}
-        ],
-        "temperature": 0.0,
-        "max_tokens": 300
-    }
+    payload = _chat_payload(system_prompt, user_text)
     return _do_request_with_payload(payload, max_attempts=max_attempts, timeout=timeout, slow_label='GigaChat-custom')
+
+_async_loop = None
+_async_client = None
+_async_sem: Optional[asyncio.Semaphore] = None
+
+def _is_cert_error(exc) -> bool:
+    return 'certificate verify failed' in str(exc).lower()
+
+def _async_state():
+    global _async_loop, _async_client, _async_sem
+    if httpx is None:
+        raise RuntimeError('httpx is not installed')
+    loop = asyncio.get_running_loop()
+    if _async_loop is not loop:
+        _async_loop = loop
+        _async_client = None
+        _async_sem = asyncio.Semaphore(GIGACHAT_MAX_CONCURRENCY)
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            http2=_HTTP2,
+            verify=_tls_verify.get(urlsplit(API_URL).netloc, certifi.where()),
+            limits=httpx.Limits(max_connections=GIGACHAT_POOL_SIZE, max_keepalive_connections=GIGACHAT_POOL_SIZE),
+        )
+    return _async_client, _async_sem
+
+async def aclose():
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
+
+async def run_limited(fn, *args, **kwargs):
+    _, sem = _async_state()
+    async with sem:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+async def _ado_request_with_payload(payload, max_attempts=2, timeout=8, slow_label='GigaChat'):
+    client, sem = _async_state()
+    token = await asyncio.to_thread(_get_cached_token)
+    if not token:
+        return {'success': False, 'error': 'ИИ помощник не настроен', 'raw': None}
+    attempt = 0
+    last_err = None
+    async with sem:
+        while attempt < max_attempts:
+            attempt += 1
+            if not gigachat_breaker.allow():
+                return {'success': False, 'error': 'GigaChat временно недоступен', 'raw': None, 'circuit_open': True}
+            try:
+                start = time.time()
+                r = await client.post(
+                    API_URL,
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Content-Type": "application/json",
+                    },
+                    json=payload,
+                    timeout=httpx.Timeout(timeout, connect=3)
+                )
+                elapsed = time.time() - start
+                if elapsed > 5:
+                    logger.warning('Slow %s request: %.2fs (attempt %s)', slow_label, elapsed, attempt)
+
+                if _is_breaker_failure(r.status_code):
+                    gigachat_breaker.record_failure()
+                else:
+                    gigachat_breaker.record_success()
+
+                if r.status_code == 200:
+                    _record_latency(elapsed)
+                    content, data = _extract_content_from_response(r)
+                    if content is None and data is None:
+                        return {'success': False, 'error': 'Invalid JSON from API', 'raw': r.text}
+                    return {'success': True, 'raw': content, 'response': data}
+
+                last_err = f'HTTP {r.status_code}'
+                if r.status_code == 401:
+                    gigachat_tokens.invalidate()
+                    token = await asyncio.to_thread(_get_cached_token)
+                    if token:
+                        continue
+                if r.status_code in (429, 500, 502, 503, 504):
+                    await asyncio.sleep(attempt * 1.0)
+                    continue
+                return {'success': False, 'error': f'Ошибка API GigaChat (код {r.status_code})', 'raw': r.text}
+            except asyncio.CancelledError:
+                gigachat_breaker.release_probe()
+                raise
+            except httpx.HTTPError as exc:
+                last_err = str(exc)
+                host = urlsplit(API_URL).netloc
+                if isinstance(exc, httpx.ConnectError) and _is_cert_error(exc) and _tls_verify.get(host) is not False:
+                    logger.warning('TLS verification failed for %s, falling back to verify=False', host)
+                    _tls_verify[host] = False
+                    gigachat_breaker.release_probe()
+                    await aclose()
+                    client, _ = _async_state()
+                    attempt -= 1
+                    continue
+                gigachat_breaker.record_failure()
+                logger.exception('HTTPError on %s request: %s', slow_label, exc)
+                await asyncio.sleep(attempt * 0.5)
+                continue
+    return {'success': False, 'error': f'Ошибка соединения с GigaChat: {last_err}', 'raw': None}
+
+async def apost_conversation(user_text: str, max_attempts: int = 2, timeout: int = 8):
+    payload = _chat_payload(CONVERSATION_SYSTEM_PROMPT, user_text)
+    return await _ado_request_with_payload(payload, max_attempts=max_attempts, timeout=timeout, slow_label='GigaChat-conv')
+
+async def apost_custom(system_prompt: str, user_text: str, max_attempts: int = 2, timeout: int = 8):
+    payload = _chat_payload(system_prompt, user_text)
+    return await _ado_request_with_payload(payload, max_attempts=max_attempts, timeout=timeout, slow_label='GigaChat-custom')
@@ -1,63 +1,195 @@
 from __future__ import annotations
-from datetime import datetime, time as dtime, timedelta
+from datetime import date, datetime, time as dtime, timedelta
+import os
 import re
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, Iterable, List, Tuple
 
 import dateparser
+from dateutil.relativedelta import relativedelta
+
+try:
+    from backend.taxonomy import ACTIVITY_NORMALIZATION, CATEGORIES, profile
+    from backend.taxonomy import activity_category as category_for_activity, activity_title as title_for_verb
+except Exception:
+    from taxonomy import ACTIVITY_NORMALIZATION, CATEGORIES, profile
+    from taxonomy import activity_category as category_for_activity, activity_title as title_for_verb
 
 try:
     import spacy
     _SPACY_AVAILABLE = True
-    _SPACY_NLP = None
 except Exception:
     spacy = None
     _SPACY_AVAILABLE = False
-    _SPACY_NLP = None
 
-DEFAULT_CATEGORIES = ["Работа", "Учеба", "Личное", "Здоровье", "Покупки", "Встречи"]
+SPACY_MODELS = tuple(m for m in os.getenv("SPACY_MODELS", "ru_core_news_sm,ru_core_news_md").split(",") if m)
+SPACY_EXCLUDE = ("parser", "ner")
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "64"))
+
+_SPACY_NLP = None
+_SPACY_LOADED = False
+_SPACY_LOCK = threading.Lock()
+
+def _load_spacy():
+    for name in SPACY_MODELS:
+        try:
+            return spacy.load(name, exclude=list(SPACY_EXCLUDE))
+        except Exception:
+            continue
+    return None
+
+def get_nlp():
+    global _SPACY_NLP, _SPACY_LOADED
+    if _SPACY_LOADED or not _SPACY_AVAILABLE:
+        return _SPACY_NLP
+    with _SPACY_LOCK:
+        if not _SPACY_LOADED:
+            _SPACY_NLP = _load_spacy()
+            _SPACY_LOADED = True
+    return _SPACY_NLP
+
+def warmup() -> bool:
+    nlp = get_nlp()
+    if nlp is None:
+        return False
+    nlp("завтра купить хлеб")
+    return True
+
+DEFAULT_CATEGORIES = CATEGORIES
+
+CONFIDENCE_WEIGHTS = {"date": 0.4, "time": 0.3, "activity": 0.2, "category": 0.1}
+
+def _match_category(text: str) -> Optional[str]:
+    return profile(text).hint
 
 def _detect_category(text: str) -> str:
-    t = text.lower()
-    mapping = {
-        "работ": "Работа",
-        "собеседован": "Работа",
-        "учеб": "Учеба",
-        "школ": "Учеба",
-        "унив": "Учеба",
-        "мед": "Здоровье",
-        "врач": "Здоровье",
-        "здоров": "Здоровье",
-        "куп": "Покупки",
-        "магазин": "Покупки",
-        "встреч": "Встречи",
-        "встрет": "Встречи",
-        "семья": "Личное",
-        "мама": "Личное",
-        "папа": "Личное",
-        "документ": "Личное",
-    }
+    return _match_category(text) or "Личное"
 
-    for k, v in mapping.items():
-        if k in t:
-            return v
-    return "Личное"
+def confidence_from_signals(signals: Dict[str, bool]) -> float:
+    return round(sum((w for k, w in CONFIDENCE_WEIGHTS.items() if signals.get(k)), 0.0), 2)
 
 def _detect_priority(text: str) -> str:
-    t = text.lower()
-    high_words = ["срочно", "важно", "критично", "очень надо", "!!!"]
-    low_words = ["не срочно", "когда будет время", "может быть"]
-    for w in high_words:
-        if w in t:
-            return "high"
-    for w in low_words:
-        if w in t:
-            return "low"
-    return "medium"
+    return profile(text).priority
+
+_NUMBER_WORDS = {
+    'один': 1, 'одну': 1, 'два': 2, 'две': 2, 'три': 3, 'четыре': 4, 'пять': 5,
+    'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10,
+}
+
+_WEEKDAYS = {
+    'понедельник': 0, 'понедельнику': 0,
+    'вторник': 1, 'вторнику': 1,
+    'среда': 2, 'среду': 2, 'среде': 2,
+    'четверг': 3, 'четвергу': 3,
+    'пятница': 4, 'пятницу': 4, 'пятнице': 4,
+    'суббота': 5, 'субботу': 5, 'субботе': 5,
+    'воскресенье': 6, 'воскресенью': 6,
+}
+
+_MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+_RELATIVE_DAY_RE = re.compile(r"\b(послезавтра|сегодня|завтра)\b")
+_RELATIVE_OFFSETS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+_IN_N_RE = re.compile(
+    r"\bчерез\s+(?:(\d{1,3}|" + "|".join(_NUMBER_WORDS) + r")\s+)?(дн[еяь]й?|день|недел[юиь]|месяц)"
+)
+_WEEKDAY_RE = re.compile(
+    r"\b(?:(?:в|во|к|на)\s+)?(следующ\w*\s+)?(" + "|".join(_WEEKDAYS) + r")\b"
+)
+_NUMERIC_DATE_RE = re.compile(r"(?<![\d:])(\b(?:в|во|к|на)\s+)?(\d{1,2})\.(\d{1,2})(?:\.(\d{2,4}))?(?![\d:])")
+_RECENT_PAST_DAYS = 31
+_TIME_RE = re.compile(r"(?<!\d)(\d{1,2})[:\.](\d{2})")
+_TEXT_DATE_RE = re.compile(r"\b(\d{1,2})\s+(" + "|".join(_MONTHS) + r")(?:\s+(\d{4}))?")
+
+def _numeric_date(t: str, today: date) -> Optional[Tuple[date, Tuple[int, int]]]:
+    for m in _NUMERIC_DATE_RE.finditer(t):
+        day, month = int(m.group(2)), int(m.group(3))
+        year = int(m.group(4)) if m.group(4) else today.year
+        if year < 100:
+            year += 2000
+        try:
+            found = date(year, month, day)
+        except ValueError:
+            continue
+        if not m.group(4):
+            time_like = day < 24 and len(m.group(3)) == 2
+            if time_like and m.group(1):
+                continue
+            if found < today:
+                if time_like and (today - found).days <= _RECENT_PAST_DAYS:
+                    continue
+                try:
+                    found = found.replace(year=year + 1)
+                except ValueError:
+                    pass
+        return found, m.span(2)
+    return None
 
-def _extract_time(text: str) -> Optional[dtime]:
+def fast_parse_date(text: str, today: Optional[date] = None) -> Optional[date]:
+    t = (text or "").lower().replace("ё", "е")
+    today = today or date.today()
 
-    m = re.search(r"(\d{1,2})[:\.](\d{2})", text)
+    m = _RELATIVE_DAY_RE.search(t)
     if m:
+        return today + timedelta(days=_RELATIVE_OFFSETS[m.group(1)])
+
+    m = _IN_N_RE.search(t)
+    if m:
+        raw_n, unit = m.group(1), m.group(2)
+        n = 1 if raw_n is None else (int(raw_n) if raw_n.isdigit() else _NUMBER_WORDS[raw_n])
+        if unit.startswith('недел'):
+            return today + timedelta(weeks=n)
+        if unit == 'месяц':
+            return today + relativedelta(months=n)
+        return today + timedelta(days=n)
+
+    found = _numeric_date(t, today)
+    if found:
+        return found[0]
+
+    m = _TEXT_DATE_RE.search(t)
+    if m:
+        day, month = int(m.group(1)), _MONTHS[m.group(2)]
+        year = int(m.group(3)) if m.group(3) else today.year
+        try:
+            found = date(year, month, day)
+        except ValueError:
+            found = None
+        if found:
+            if not m.group(3) and found < today:
+                try:
+                    found = found.replace(year=year + 1)
+                except ValueError:
+                    pass
+            return found
+
+    m = _WEEKDAY_RE.search(t)
+    if m:
+        weekday = _WEEKDAYS[m.group(2)]
+        ahead = (weekday - today.weekday()) % 7 or 7
+        if m.group(1):
+            ahead = (weekday - today.weekday()) % 7 + 7
+        return today + timedelta(days=ahead)
+
+    return None
+
+def _dateparser_date(raw: str) -> Optional[date]:
+    settings = {
+        'PREFER_DATES_FROM': 'future',
+        'RELATIVE_BASE': datetime.now()
+    }
+    parsed = dateparser.parse(raw, languages=['ru'], settings=settings)
+    return parsed.date() if parsed else None
+
+def _extract_time(text: str) -> Optional[dtime]:
+    t = text.lower()
+    date_token = _numeric_date(t, date.today())
+    for m in _TIME_RE.finditer(t):
+        if date_token and m.start() == date_token[1][0]:
+            continue
         h = int(m.group(1))
         mi = int(m.group(2))
         if 0 <= h < 24 and 0 <= mi < 60:
@@ -80,7 +212,37 @@ def _make_title(description: str, max_words: int = 6) -> str:
     title = " ".join(title_words)
     return title.capitalize()
 
-def local_parse(text: str) -> Optional[Dict[str, Any]]:
+def _activity_from_doc(doc) -> Tuple[Optional[str], Optional[str]]:
+    verb_lemmas = [tok.lemma_ for tok in doc if tok.pos_ in ("VERB", "INF")]
+    noun_lemmas = [tok.lemma_ for tok in doc if tok.pos_ == "NOUN"]
+
+    chosen = verb_lemmas[0] if verb_lemmas else (noun_lemmas[0] if noun_lemmas else None)
+    if not chosen:
+        return None, None
+
+    chosen = chosen.lower()
+    if chosen.endswith("ть"):
+        activity_title = chosen[:-1] + "ие"
+    else:
+        activity_title = chosen
+
+    activity_title = (
+        ACTIVITY_NORMALIZATION.get(chosen)
+        or ACTIVITY_NORMALIZATION.get(activity_title)
+        or activity_title.capitalize()
+    )
+    return activity_title, category_for_activity(activity_title)
+
+def local_parse_many(texts: Iterable[str], batch_size: int = SPACY_BATCH_SIZE) -> List[Optional[Dict[str, Any]]]:
+    texts = list(texts)
+    nlp = get_nlp()
+    if nlp is None:
+        return [local_parse(t) for t in texts]
+    stripped = [(t or "").strip() for t in texts]
+    docs = nlp.pipe(stripped, batch_size=batch_size)
+    return [local_parse(t, doc=d) for t, d in zip(texts, docs)]
+
+def local_parse(text: str, doc=None) -> Optional[Dict[str, Any]]:
     
     if not text or not text.strip():
         return None
@@ -89,33 +251,11 @@ def local_parse(text: str) -> Optional[Dict[str, Any]]:
 
     extracted_time = _extract_time(raw)
 
-    settings = {
-        'PREFER_DATES_FROM': 'future',
-        'RELATIVE_BASE': datetime.now()
-    }
-
-    parsed = dateparser.parse(raw, languages=['ru'], settings=settings)
-
-    parsed_date = None
-    if parsed:
-        parsed_date = parsed.date()
-
+    parsed_date = fast_parse_date(raw)
     if not parsed_date:
-        t = raw.lower()
-        if 'сегодня' in t:
-            parsed_date = datetime.now().date()
-        elif 'завтра' in t:
-            parsed_date = (datetime.now() + timedelta(days=1)).date()
-        elif 'послезавтра' in t:
-            parsed_date = (datetime.now() + timedelta(days=2)).date()
-        else:
-
-            m = re.search(r'через\s+(\d+)\s+дн', t)
-            if m:
-                parsed_date = (datetime.now() + timedelta(days=int(m.group(1)))).date()
-            else:
-                parsed_date = None
+        parsed_date = _dateparser_date(raw)
 
+    date_found = parsed_date is not None
     if not parsed_date:
         parsed_date = datetime.now().date()
 
@@ -125,7 +265,8 @@ def local_parse(text: str) -> Optional[Dict[str, Any]]:
 
     description = _clean_description(raw)
     title = _make_title(description)
-    category = _detect_category(raw)
+    matched_category = _match_category(raw)
+    category = matched_category or "Личное"
     priority = _detect_priority(raw)
 
     activity_title = None
@@ -137,19 +278,7 @@ def local_parse(text: str) -> Optional[Dict[str, Any]]:
 
             verb = re.sub(r"[^а-яё]+$", "", verb)
 
-            verb_norm_map = {
-                'плав': 'Плавание',
-                'плы': 'Плавание',
-                'бег': 'Бег',
-                'тренир': 'Тренировка',
-                'спорт': 'Спорт',
-                'куп': 'Покупки',
-            }
-            activity_title = None
-            for k, v in verb_norm_map.items():
-                if k in verb:
-                    activity_title = v
-                    break
+            activity_title = title_for_verb(verb)
             if not activity_title:
 
                 if verb.endswith('ть'):
@@ -162,92 +291,21 @@ def local_parse(text: str) -> Optional[Dict[str, Any]]:
                     candidate = verb
                 activity_title = candidate.capitalize()
 
-            cat_map = {
-                'плав': 'Здоровье',
-                'бег': 'Здоровье',
-                'тренир': 'Здоровье',
-                'спорт': 'Здоровье',
-                'куп': 'Покупки',
-            }
-            for k, v in cat_map.items():
-                if k in activity_title.lower():
-                    activity_category = v
-                    break
+            activity_category = category_for_activity(activity_title)
     except Exception:
         activity_title = None
         activity_category = None
 
     try:
-        if _SPACY_AVAILABLE:
-            try:
-                if _SPACY_NLP is None:
-
-                    try:
-                        _SPACY_NLP = spacy.load("ru_core_news_sm")
-                    except Exception:
-
-                        try:
-                            _SPACY_NLP = spacy.load("ru_core_news_md")
-                        except Exception:
-                            _SPACY_NLP = None
-
-                if _SPACY_NLP:
-                    doc = _SPACY_NLP(raw)
-
-                    verb_lemmas = [tok.lemma_ for tok in doc if tok.pos_ in ("VERB", "INF")]
-
-                    noun_lemmas = [tok.lemma_ for tok in doc if tok.pos_ == "NOUN"]
-
-                    chosen = None
-                    if verb_lemmas:
-                        chosen = verb_lemmas[0]
-                    elif noun_lemmas:
-                        chosen = noun_lemmas[0]
-
-                    if chosen:
-
-                        act = chosen
-
-                        if act.endswith("ть"):
-                            stem = act[:-1]
-                            activity_title = (stem + "ие").lower()
-                        else:
-                            activity_title = act.lower()
-
-                        normalization = {
-                            'плавание': 'Плавание',
-                            'плавать': 'Плавание',
-                            'плыть': 'Плавание',
-                            'бег': 'Бег',
-                            'бегать': 'Бег',
-                            'тренировка': 'Тренировка',
-                            'спорт': 'Спорт',
-                        }
-                        normalized = normalization.get(activity_title, None)
-                        if normalized:
-                            activity_title = normalized
-                        else:
-
-                            activity_title = activity_title.capitalize()
-
-                        cat_map = {
-                            'плав': 'Здоровье',
-                            'бег': 'Здоровье',
-                            'тренир': 'Здоровье',
-                            'спорт': 'Здоровье',
-                            'йог': 'Здоровье',
-                            'куп': 'Покупки',
-                            'встр': 'Встречи',
-                            'работ': 'Работа',
-                            'учеб': 'Учеба',
-                        }
-                        for k, v in cat_map.items():
-                            if k in activity_title.lower():
-                                activity_category = v
-                                break
-            except Exception:
-                activity_title = None
-                activity_category = None
+        if doc is None:
+            nlp = get_nlp()
+            doc = nlp(raw) if nlp is not None else None
+        if doc is not None:
+            spacy_title, spacy_category = _activity_from_doc(doc)
+            if spacy_title:
+                activity_title = spacy_title
+                if spacy_category:
+                    activity_category = spacy_category
     except Exception:
         activity_title = None
         activity_category = None
@@ -257,13 +315,22 @@ def local_parse(text: str) -> Optional[Dict[str, Any]]:
         if activity_category:
             category = activity_category
 
+    signals = {
+        'date': date_found,
+        'time': extracted_time is not None,
+        'activity': bool(activity_title),
+        'category': bool(matched_category or activity_category),
+    }
+
     return {
         'date': parsed_date,
         'time': extracted_time,
         'description': description,
         'title': title,
         'category': category,
-        'priority': priority
+        'priority': priority,
+        'signals': signals,
+        'confidence': confidence_from_signals(signals)
     }
 
 if __name__ == '__main__':
@@ -3,16 +3,28 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import json
+import os
 import re
 from typing import Any, Dict, List, Optional, Tuple, Union
 
-CATEGORIES = {"Работа", "Учеба", "Личное", "Здоровье", "Покупки", "Встречи"}
-PRIORITIES = {"high", "medium", "low"}
+try:
+    from backend.taxonomy import CATEGORIES, PRIORITIES
+except Exception:
+    from taxonomy import CATEGORIES, PRIORITIES
 
 VIEWS = {"Работа", "Учеба", "Личное", "Здоровье", "Покупки", "Встречи", "Список"}
 
+PROMPT_VERSION = "1"
+
+PROMPT_TASKS_WINDOW_DAYS = int(os.getenv("PROMPT_TASKS_WINDOW_DAYS", "7"))
+PROMPT_TASKS_TOKEN_BUDGET = int(os.getenv("PROMPT_TASKS_TOKEN_BUDGET", "1200"))
+
+_USER_TEXT_SLOT = "\x00user_text\x00"
+_EXISTING_SLOT = "\x00existing_tasks\x00"
+
 _DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 _TIME_RE = re.compile(r"^\d{2}:\d{2}$")
 
@@ -35,8 +47,58 @@ class ChatOut:
 
 ModelOut = Union[TaskOut, ChatOut]
 
-def build_gigachat_prompt(user_text: str, existing_tasks: Optional[List[dict]] = None) -> str:
-    now = datetime.now()
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 2) // 3
+
+def _task_start(task: dict) -> Optional[datetime]:
+    start = task.get("start") or task.get("start_time")
+    if isinstance(start, datetime):
+        return start
+    if isinstance(start, str):
+        try:
+            return datetime.fromisoformat(start)
+        except ValueError:
+            return None
+    return None
+
+def format_existing_tasks(
+    existing_tasks: Optional[List[dict]],
+    around: Optional[date] = None,
+    window_days: int = PROMPT_TASKS_WINDOW_DAYS,
+    token_budget: int = PROMPT_TASKS_TOKEN_BUDGET,
+) -> str:
+    if not existing_tasks:
+        return "null"
+
+    around = around or date.today()
+    lo = around - timedelta(days=window_days)
+    hi = around + timedelta(days=window_days)
+
+    in_window: List[Tuple[int, datetime, dict]] = []
+    for task in existing_tasks:
+        start = _task_start(task)
+        if start is not None and lo <= start.date() <= hi:
+            in_window.append((abs((start.date() - around).days), start, task))
+    in_window.sort(key=lambda t: (t[0], t[1]))
+
+    kept: List[Tuple[datetime, str]] = []
+    used = 2
+    for _, start, task in in_window:
+        chunk = json.dumps(task, ensure_ascii=False, default=str)
+        cost = estimate_tokens(chunk) + 1
+        if used + cost > token_budget:
+            break
+        kept.append((start, chunk))
+        used += cost
+
+    if not kept:
+        return "null"
+    kept.sort(key=lambda t: t[0])
+    return "[" + ",".join(chunk for _, chunk in kept) + "]"
+
+@lru_cache(maxsize=2)
+def _static_prompt(day: date) -> str:
+    now = datetime.combine(day, datetime.min.time())
     today_date = now.strftime("%Y-%m-%d")
     tomorrow_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
     next_week_date = (now + timedelta(days=7)).strftime("%Y-%m-%d")
@@ -51,11 +113,25 @@ def build_gigachat_prompt(user_text: str, existing_tasks: Optional[List[dict]] =
         "воскресенье",
     ][now.weekday()]
 
-    existing_json = json.dumps(existing_tasks, ensure_ascii=False, default=str) if existing_tasks else "null"
+    user_text = _USER_TEXT_SLOT
+    existing_json = _EXISTING_SLOT
 
     template = f
     return template.strip()
 
+def build_gigachat_prompt(
+    user_text: str,
+    existing_tasks: Optional[List[dict]] = None,
+    around: Optional[date] = None,
+) -> str:
+    today = date.today()
+    existing_json = format_existing_tasks(existing_tasks, around=around or today)
+    return (
+        _static_prompt(today)
+        .replace(_EXISTING_SLOT, existing_json)
+        .replace(_USER_TEXT_SLOT, user_text)
+    )
+
 def call_gigachat(system_prompt: str) -> str:
     
 
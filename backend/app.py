@@ -16,19 +16,29 @@ from dateutil import parser as dtparser
 from fastapi import FastAPI, Request, Depends, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from backend.database import get_db, create_tables, Event, get_user_creds, save_user_creds, ensure_user_exists
-from backend.google_calendar import (
-    create_google_event,
-    delete_google_event,
-    sync_google_calendar,
-    upsert_google_event
+from backend.database import (
+    get_db, get_async_db, create_tables, Event, User, get_user_creds, save_user_creds, ensure_user_exists,
+    ensure_user_exists_async, save_sync_token, pool_metrics
 )
+from backend.google_calendar import push_local_events
+from backend.sync_worker import sync_scheduler
+from backend.availability import working_hours_for
+from backend.slot_search import SLOT_SEARCH_MAX_DAYS, CursorExpired, next_page, search_slots
+from backend.batch_scheduler import (
+    BATCH_HORIZON_DAYS, BATCH_MAX_TASKS, commit_plan, plan_for_user, task_from_dict, tasks_from_text
+)
+from backend.extraction_cache import extraction_cache
+from backend.ai_client import client_metrics
+from backend.taxonomy import cache_stats as taxonomy_cache_stats
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request as GoogleRequest
 
-from backend.ai import ask_gigachat, auto_assign_category
+from backend.ai import ask_gigachat, auto_assign_category, auto_assign_categories as classify_categories, tier_metrics
+from backend.ai_parser import warmup as warmup_parser
 
 CLIENT_SECRETS_FILE = os.path.join("secrets", "client_secret.json")
 SCOPES = ["https://www.googleapis.com/auth/calendar",
@@ -110,7 +120,7 @@ def oauth_login(request: Request):
     return resp
 
 @app.get("/oauth2/callback")
-def oauth_callback(request: Request, db: Session = Depends(get_db)):
+def oauth_callback(request: Request):
     code = request.query_params.get("code")
     if not code:
         return JSONResponse({"error": "missing code"}, status_code=400)
@@ -127,26 +137,10 @@ def oauth_callback(request: Request, db: Session = Depends(get_db)):
 
         creds = flow.credentials
         save_user_creds(user_id, creds)
+        save_sync_token(user_id, None)
 
-        sync_google_calendar(user_id)
-
-        local_events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.external_id.is_(None)
-        ).all()
-
-        for ev in local_events:
-            gid = create_google_event(user_id, {
-                "title": ev.title,
-                "description": ev.description or "",
-                "start": ev.start_time.isoformat(),
-                "end": ev.end_time.isoformat()
-            })
-            if gid:
-                ev.external_id = gid
-                ev.source = "google"
-
-        db.commit()
+        push_local_events(user_id)
+        sync_scheduler.request_sync(user_id, delay=0)
 
         redirect_url = os.getenv("FRONTEND_URL", "https://pomnyasha.ru")
         resp = RedirectResponse(redirect_url)
@@ -183,12 +177,12 @@ def me(request: Request, response: Response):
     return {"authorized": True}
 
 @app.get("/events")
-def get_events(request: Request, response: Response, db: Session = Depends(get_db)):
+async def get_events(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     user_id, _ = _get_or_create_session(request)
-    ensure_user_exists(user_id)
+    await ensure_user_exists_async(user_id)
     _persist_session(response, user_id)
 
-    events = db.query(Event).filter(Event.user_id == user_id).all()
+    events = (await db.scalars(select(Event).where(Event.user_id == user_id))).all()
 
     return [{
         "id": e.id,
@@ -201,15 +195,15 @@ def get_events(request: Request, response: Response, db: Session = Depends(get_d
     } for e in events]
 
 @app.post("/events")
-def create_event(
+async def create_event(
     data: Dict[str, Any],
     request: Request,
     response: Response,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         user_id, _ = _get_or_create_session(request)
-        ensure_user_exists(user_id)
+        await ensure_user_exists_async(user_id)
         _persist_session(response, user_id)
 
         title = data.get("title", "Без названия")
@@ -229,16 +223,9 @@ def create_event(
         )
 
         db.add(ev)
-        db.commit()
-        db.refresh(ev)
-
-        gid = upsert_google_event(user_id, ev)
-        if gid:
-            ev.external_id = gid
-            ev.source = "google"
-            db.commit()
+        await db.commit()
 
-        sync_google_calendar(user_id)
+        sync_scheduler.request_sync(user_id, upsert_event_ids=[ev.id])
 
         return {"status": "ok", "id": ev.id}
 
@@ -246,21 +233,21 @@ def create_event(
         return JSONResponse({"error": f"create_event failed: {e}"}, status_code=400)
 
 @app.put("/events/{event_id}")
-def update_event(
+async def update_event(
     event_id: int,
     data: Dict[str, Any],
     request: Request,
     response: Response,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         user_id, _ = _get_or_create_session(request)
         _persist_session(response, user_id)
 
-        ev = db.query(Event).filter(
+        ev = await db.scalar(select(Event).where(
             Event.id == event_id,
             Event.user_id == user_id
-        ).first()
+        ))
 
         if not ev:
             raise HTTPException(status_code=404)
@@ -273,11 +260,9 @@ def update_event(
         if "end" in data:
             ev.end_time = _parse_dt(data["end"])
 
-        db.commit()
-        db.refresh(ev)
+        await db.commit()
 
-        upsert_google_event(user_id, ev)
-        sync_google_calendar(user_id)
+        sync_scheduler.request_sync(user_id, upsert_event_ids=[ev.id])
 
         return {"status": "updated"}
 
@@ -285,24 +270,24 @@ def update_event(
         return JSONResponse({"error": f"update_event failed: {e}"}, status_code=400)
 
 @app.delete("/events/{event_id}")
-def delete_event(event_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+async def delete_event(event_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     try:
         user_id, _ = _get_or_create_session(request)
         _persist_session(response, user_id)
 
-        ev = db.query(Event).filter(
+        ev = await db.scalar(select(Event).where(
             Event.id == event_id,
             Event.user_id == user_id
-        ).first()
+        ))
 
         if not ev:
             raise HTTPException(404)
 
-        delete_google_event(user_id, ev)
-        db.delete(ev)
-        db.commit()
+        external_id = ev.external_id
+        await db.delete(ev)
+        await db.commit()
 
-        sync_google_calendar(user_id)
+        sync_scheduler.request_sync(user_id, delete_external_ids=[external_id])
 
         return {"status": "deleted"}
 
@@ -313,9 +298,20 @@ def delete_event(event_id: int, request: Request, response: Response, db: Sessio
 def do_sync(request: Request, response: Response):
     user_id, _ = _get_or_create_session(request)
     _persist_session(response, user_id)
-    sync_google_calendar(user_id)
+    sync_scheduler.request_sync(user_id, delay=0)
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "sync": sync_scheduler.metrics(),
+        "db": pool_metrics(),
+        "extraction_cache": extraction_cache.stats(),
+        "gigachat": client_metrics(),
+        "ai_tiers": tier_metrics(),
+        "taxonomy": taxonomy_cache_stats(),
+    }
+
 @app.post("/suggest-times")
 def suggest_times(data: Dict[str, Any], request: Request, response: Response, db: Session = Depends(get_db)):
     try:
@@ -345,7 +341,8 @@ def suggest_times(data: Dict[str, Any], request: Request, response: Response, db
             description,
             existing_events,
             priority,
-            exclude_times
+            exclude_times,
+            hours=working_hours_for(db, user_id)
         )
 
         if suggested_time:
@@ -360,6 +357,112 @@ def suggest_times(data: Dict[str, Any], request: Request, response: Response, db
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.post("/suggest-slots")
+def suggest_slots(data: Dict[str, Any], request: Request, response: Response, db: Session = Depends(get_db)):
+    user_id, _ = _get_or_create_session(request)
+    _persist_session(response, user_id)
+
+    try:
+        limit = max(1, min(int(data.get("limit") or 10), 50))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "invalid limit"}, status_code=400)
+
+    cursor = data.get("cursor")
+    if cursor:
+        try:
+            return next_page(user_id, str(cursor), limit)
+        except CursorExpired:
+            return JSONResponse({"error": "cursor expired, repeat the search"}, status_code=410)
+
+    date_from = data.get("date_from") or data.get("date")
+    if not date_from:
+        return JSONResponse({"error": "missing date_from"}, status_code=400)
+
+    try:
+        start_day = datetime.fromisoformat(date_from).date()
+        end_day = datetime.fromisoformat(data["date_to"]).date() if data.get("date_to") else start_day + timedelta(days=6)
+        return search_slots(
+            db,
+            user_id,
+            start_day,
+            end_day,
+            description=data.get("description", ""),
+            priority=data.get("priority", "medium"),
+            duration_minutes=int(data.get("duration_minutes") or 30),
+            exclude_times=data.get("exclude_times", []),
+            limit=limit,
+        )
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@app.post("/schedule-batch")
+def schedule_batch(data: Dict[str, Any], request: Request, response: Response, db: Session = Depends(get_db)):
+    user_id, _ = _get_or_create_session(request)
+    _persist_session(response, user_id)
+
+    try:
+        if data.get("text"):
+            tasks = tasks_from_text(str(data["text"]))
+        else:
+            tasks = [task_from_dict(t) for t in data.get("tasks") or []]
+        start_day = datetime.fromisoformat(data["date_from"]).date() if data.get("date_from") else datetime.now().date()
+        horizon_days = max(1, min(int(data.get("horizon_days") or BATCH_HORIZON_DAYS), SLOT_SEARCH_MAX_DAYS))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return JSONResponse({"error": f"invalid tasks: {e}"}, status_code=400)
+
+    if not tasks:
+        return JSONResponse({"error": "no tasks"}, status_code=400)
+    if len(tasks) > BATCH_MAX_TASKS:
+        return JSONResponse({"error": f"at most {BATCH_MAX_TASKS} tasks per batch"}, status_code=400)
+
+    body = plan_for_user(db, user_id, tasks, start_day, horizon_days)
+
+    event_ids, skipped = [], []
+    if data.get("commit") and body["plan"]:
+        ensure_user_exists(user_id)
+        try:
+            event_ids, skipped = commit_plan(db, user_id, body["plan"], allow_conflicts=bool(data.get("allow_conflicts")))
+        except Exception as e:
+            return JSONResponse({"error": f"schedule_batch failed: {e}"}, status_code=500)
+
+    body["committed"] = bool(event_ids)
+    body["event_ids"] = event_ids
+    body["skipped_conflicts"] = [item["index"] for item in skipped]
+    return body
+
+@app.put("/working-hours")
+def set_working_hours(data: Dict[str, Any], request: Request, response: Response, db: Session = Depends(get_db)):
+    user_id, _ = _get_or_create_session(request)
+    _persist_session(response, user_id)
+
+    work_start = data.get("work_start")
+    work_end = data.get("work_end")
+    buffer_minutes = data.get("buffer_minutes")
+    try:
+        if work_start is not None and work_end is not None:
+            if datetime.strptime(work_end, "%H:%M") <= datetime.strptime(work_start, "%H:%M"):
+                return JSONResponse({"error": "work_end must be after work_start"}, status_code=400)
+        elif work_start is not None or work_end is not None:
+            return JSONResponse({"error": "work_start and work_end must be set together"}, status_code=400)
+        if buffer_minutes is not None and not (0 <= int(buffer_minutes) <= 240):
+            return JSONResponse({"error": "buffer_minutes must be between 0 and 240"}, status_code=400)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "invalid working hours"}, status_code=400)
+
+    ensure_user_exists(user_id)
+    user = db.get(User, user_id)
+    user.work_start = work_start
+    user.work_end = work_end
+    user.buffer_minutes = int(buffer_minutes) if buffer_minutes is not None else None
+    db.commit()
+
+    hours = working_hours_for(db, user_id)
+    return {
+        "work_start": hours.start.strftime("%H:%M"),
+        "work_end": hours.end.strftime("%H:%M"),
+        "buffer_minutes": hours.buffer_minutes,
+    }
+
 @app.get("/stats")
 def get_stats(request: Request, response: Response, db: Session = Depends(get_db)):
     try:
@@ -459,11 +562,8 @@ def chat_endpoint(data: Dict[str, Any], request: Request, response: Response, db
             (Event.view.is_(None) | (Event.view == ""))
         ).limit(10).all()
 
-        for event in events_without_category:
-            category = auto_assign_category(
-                event.title or "",
-                event.description or ""
-            )
+        categories = classify_categories((event.title, event.description) for event in events_without_category)
+        for event, category in zip(events_without_category, categories):
             event.view = category
 
         if events_without_category:
@@ -534,6 +634,17 @@ def chat_endpoint(data: Dict[str, Any], request: Request, response: Response, db
         sid, created = _get_or_create_session(request)
 
         proposal = pending_proposals.get(sid)
+        if proposal and isinstance(proposal, dict) and proposal.get('type') == 'batch_proposal':
+            try:
+                event_ids, skipped = commit_plan(db, user_id, proposal['plan']['plan'])
+            except Exception as e:
+                return {"reply": {"type": "text", "content": f"Ошибка при создании событий: {e}"}}
+            pending_proposals.pop(sid, None)
+            content = f"✅ Добавлено событий: {len(event_ids)}"
+            if skipped:
+                content += "\nПропущены из-за пересечений: " + ", ".join(item["title"] for item in skipped)
+            return {"reply": {"type": "text", "content": content, "event_ids": event_ids}}
+
         if proposal and isinstance(proposal, dict):
 
             try:
@@ -567,6 +678,7 @@ def chat_endpoint(data: Dict[str, Any], request: Request, response: Response, db
                         title,
                         existing_events,
                         processed.get("priority", "medium"),
+                        hours=working_hours_for(db, user_id),
                     )
 
                     if suggested_time:
@@ -589,19 +701,7 @@ def chat_endpoint(data: Dict[str, Any], request: Request, response: Response, db
                 db.commit()
                 db.refresh(new_event)
 
-                try:
-                    gid = upsert_google_event(user_id, new_event)
-                    if gid:
-                        new_event.external_id = gid
-                        new_event.source = "google"
-                        db.commit()
-                except Exception as e:
-                    print(f"Ошибка создания события в Google Calendar: {e}")
-
-                try:
-                    sync_google_calendar(user_id)
-                except Exception as e:
-                    print(f"Ошибка синхронизации с Google Calendar: {e}")
+                sync_scheduler.request_sync(user_id, upsert_event_ids=[new_event.id])
 
                 try:
                     del pending_proposals[sid]
@@ -615,14 +715,17 @@ def chat_endpoint(data: Dict[str, Any], request: Request, response: Response, db
     result = ask_gigachat(msg, db_session=db, user_id=user_id)
 
     try:
-        if isinstance(result, dict) and result.get('type') == 'proposal' and result.get('needs_confirmation'):
+        if isinstance(result, dict) and result.get('type') in ('proposal', 'batch_proposal') and result.get('needs_confirmation'):
             sid, _ = _get_or_create_session(request)
             pending_proposals[sid] = result
     except Exception:
         pass
 
     try:
-        if isinstance(result, dict) and (result.get('processed_task') is None) and result.get('type') == 'text':
+        if (
+            isinstance(result, dict) and result.get('processed_task') is None
+            and result.get('type') == 'text' and result.get('tier') != 'conversation'
+        ):
             try:
                 from backend.ai_client import post_conversation
             except Exception:
@@ -681,12 +784,8 @@ def auto_assign_categories(request: Request, db: Session = Depends(get_db)):
         updated_count = 0
         categories_assigned = {}
 
-        for event in events_without_category:
-
-            category = auto_assign_category(
-                event.title or "",
-                event.description or ""
-            )
+        categories = classify_categories((event.title, event.description) for event in events_without_category)
+        for event, category in zip(events_without_category, categories):
 
             event.view = category
             updated_count += 1
@@ -741,19 +840,7 @@ def confirm_event(data: Dict[str, Any], request: Request, response: Response, db
         db.commit()
         db.refresh(new_event)
 
-        try:
-            gid = upsert_google_event(user_id, new_event)
-            if gid:
-                new_event.external_id = gid
-                new_event.source = "google"
-                db.commit()
-        except Exception as e:
-            print(f"Ошибка создания события в Google Calendar: {e}")
-
-        try:
-            sync_google_calendar(user_id)
-        except Exception as e:
-            print(f"Ошибка синхронизации с Google Calendar: {e}")
+        sync_scheduler.request_sync(user_id, upsert_event_ids=[new_event.id])
 
         return {
             "success": True,
@@ -768,8 +855,14 @@ def confirm_event(data: Dict[str, Any], request: Request, response: Response, db
 @app.on_event("startup")
 def startup():
     create_tables()
+    sync_scheduler.start()
+    warmup_parser()
     print("База готова")
 
+@app.on_event("shutdown")
+def shutdown():
+    sync_scheduler.stop()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,128 @@
+import os
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+LOCAL_TZ = ZoneInfo(os.getenv("APP_TIMEZONE", "Europe/Moscow"))
+
+DEFAULT_WORK_START = time(9, 0)
+DEFAULT_WORK_END = time(18, 0)
+DEFAULT_EVENT_MINUTES = int(os.getenv("DEFAULT_EVENT_MINUTES", "30"))
+MIN_SLOT_MINUTES = 30
+
+Interval = Tuple[datetime, datetime]
+
+@dataclass(frozen=True)
+class WorkingHours:
+    start: time = DEFAULT_WORK_START
+    end: time = DEFAULT_WORK_END
+    buffer_minutes: int = 0
+
+    def window(self, day: date) -> Interval:
+        return datetime.combine(day, self.start), datetime.combine(day, self.end)
+
+DEFAULT_HOURS = WorkingHours()
+
+def to_local_naive(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        return dt.astimezone(LOCAL_TZ).replace(tzinfo=None)
+    return dt
+
+def _parse_hhmm(value: Optional[str], default: time) -> time:
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, "%H:%M").time()
+    except ValueError:
+        return default
+
+def working_hours_for(db, user_id: int) -> WorkingHours:
+    from backend.database import User
+    row = db.query(User.work_start, User.work_end, User.buffer_minutes).filter(User.user_id == user_id).first()
+    if row is None:
+        return DEFAULT_HOURS
+    start = _parse_hhmm(row.work_start, DEFAULT_WORK_START)
+    end = _parse_hhmm(row.work_end, DEFAULT_WORK_END)
+    if end <= start:
+        start, end = DEFAULT_WORK_START, DEFAULT_WORK_END
+    return WorkingHours(start=start, end=end, buffer_minutes=max(0, row.buffer_minutes or 0))
+
+def _event_interval(event) -> Optional[Interval]:
+    if isinstance(event, tuple):
+        start, end = event
+    else:
+        start, end = event.start_time, event.end_time
+    if start is None:
+        return None
+    start = to_local_naive(start)
+    end = to_local_naive(end) if end is not None else start
+    if end <= start:
+        end = start + timedelta(minutes=DEFAULT_EVENT_MINUTES)
+    return start, end
+
+class AvailabilityIndex:
+    def __init__(self, events: Iterable = (), buffer_minutes: int = 0):
+        self.buffer = timedelta(minutes=max(0, buffer_minutes))
+        intervals = sorted(filter(None, (_event_interval(e) for e in events)))
+        self._starts: List[datetime] = []
+        self._ends: List[datetime] = []
+        for start, end in intervals:
+            start, end = start - self.buffer, end + self.buffer
+            if self._ends and start <= self._ends[-1]:
+                if end > self._ends[-1]:
+                    self._ends[-1] = end
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def add(self, start: datetime, end: datetime):
+        start, end = _event_interval((start, end))
+        start, end = start - self.buffer, end + self.buffer
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        i = bisect_right(self._ends, start)
+        return i >= len(self._starts) or self._starts[i] >= end
+
+    def busy_between(self, start: datetime, end: datetime) -> Iterator[Interval]:
+        i = bisect_right(self._ends, start)
+        while i < len(self._starts) and self._starts[i] < end:
+            yield self._starts[i], self._ends[i]
+            i += 1
+
+    def free_slots(
+        self,
+        start: datetime,
+        end: datetime,
+        duration: timedelta = timedelta(minutes=MIN_SLOT_MINUTES),
+        hours: WorkingHours = DEFAULT_HOURS,
+    ) -> List[Interval]:
+        start, end = to_local_naive(start), to_local_naive(end)
+        slots: List[Interval] = []
+        day = start.date()
+        while datetime.combine(day, hours.start) < end:
+            work_start, work_end = hours.window(day)
+            cursor = max(work_start, start)
+            limit = min(work_end, end)
+            if cursor < limit:
+                for busy_start, busy_end in self.busy_between(cursor, limit):
+                    if busy_start - cursor >= duration:
+                        slots.append((cursor, busy_start))
+                    cursor = max(cursor, busy_end)
+                    if cursor >= limit:
+                        break
+                if limit - cursor >= duration:
+                    slots.append((cursor, limit))
+            day += timedelta(days=1)
+        return slots
@@ -0,0 +1,226 @@
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+from backend.ai import PRIORITIES, TIME_PREFS_BY_CATEGORY, auto_assign_category, time_category
+from backend.ai_parser import local_parse_many
+from backend.availability import AvailabilityIndex, DEFAULT_HOURS, WorkingHours, working_hours_for
+from backend.slot_search import SLOT_SEARCH_MAX_DAYS, SLOT_STEP_MINUTES, candidate_starts, events_in_range, score_slot
+from backend.sync_worker import sync_scheduler
+
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", "50"))
+BATCH_HORIZON_DAYS = int(os.getenv("BATCH_HORIZON_DAYS", "7"))
+BATCH_MAX_DURATION_MINUTES = 12 * 60
+
+_PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+_SPLIT_RE = re.compile(r"[\n;]+")
+_BULLET_RE = re.compile(r"^\s*(?:[-•*–]|\d{1,2}[.)])\s*")
+
+@dataclass
+class BatchTask:
+    title: str
+    description: str = ""
+    day: Optional[date] = None
+    at: Optional[time] = None
+    duration_minutes: int = SLOT_STEP_MINUTES
+    priority: str = "medium"
+    category: Optional[str] = None
+
+def split_tasks(text: str) -> List[str]:
+    parts = (_BULLET_RE.sub("", part).strip() for part in _SPLIT_RE.split(text or ""))
+    return [part for part in parts if part]
+
+def tasks_from_text(text: str) -> List[BatchTask]:
+    parts = split_tasks(text)
+    tasks = []
+    for part, parsed in zip(parts, local_parse_many(parts)):
+        if parsed is None:
+            continue
+        tasks.append(BatchTask(
+            title=parsed["title"] or part,
+            description=part,
+            day=parsed["date"] if parsed["signals"]["date"] else None,
+            at=parsed["time"],
+            priority=parsed["priority"],
+            category=parsed["category"] if parsed["signals"]["category"] else None,
+        ))
+    return tasks
+
+def task_from_dict(data: Dict[str, Any]) -> BatchTask:
+    title = (data.get("title") or data.get("description") or "").strip()
+    if not title:
+        raise ValueError("task without title")
+    day = datetime.strptime(data["date"], "%Y-%m-%d").date() if data.get("date") else None
+    at = datetime.strptime(data["time"], "%H:%M").time() if data.get("time") else None
+    duration = int(data.get("duration_minutes") or SLOT_STEP_MINUTES)
+    if not 0 < duration <= BATCH_MAX_DURATION_MINUTES:
+        raise ValueError(f"duration_minutes must be between 1 and {BATCH_MAX_DURATION_MINUTES}")
+    priority = data.get("priority") if data.get("priority") in PRIORITIES else "medium"
+    return BatchTask(
+        title=title,
+        description=data.get("description") or "",
+        day=day,
+        at=at,
+        duration_minutes=duration,
+        priority=priority,
+        category=data.get("category"),
+    )
+
+def _order_key(item):
+    i, task = item
+    return (task.at is None, _PRIORITY_RANK.get(task.priority, 1), -task.duration_minutes, task.day is None, i)
+
+def _best_start(index: AvailabilityIndex, task: BatchTask, first_day: date, last_day: date,
+                duration: timedelta, hours: WorkingHours, now: datetime):
+    preferred = set(TIME_PREFS_BY_CATEGORY[time_category(f"{task.title} {task.description}")])
+    best = None
+    for start in candidate_starts(index, first_day, last_day, duration, hours, now):
+        score, reasons = score_slot(start, start + duration, first_day, preferred, task.priority, index)
+        if best is None or score > best[0]:
+            best = (score, start, reasons)
+    return best
+
+def plan_batch(
+    tasks: List[BatchTask],
+    events,
+    start_day: date,
+    horizon_days: int = BATCH_HORIZON_DAYS,
+    hours: WorkingHours = DEFAULT_HOURS,
+    now: Optional[datetime] = None,
+) -> Dict[str, list]:
+    now = now or datetime.now()
+    horizon_days = max(1, min(horizon_days, SLOT_SEARCH_MAX_DAYS))
+    index = AvailabilityIndex(events, hours.buffer_minutes)
+    plan = []
+    unplaced = []
+
+    for i, task in sorted(enumerate(tasks), key=_order_key):
+        duration = timedelta(minutes=task.duration_minutes)
+        first_day = max(task.day or start_day, start_day)
+        item = {
+            "index": i,
+            "title": task.title,
+            "description": task.description,
+            "category": task.category or auto_assign_category(task.title, task.description),
+            "priority": task.priority,
+        }
+
+        if task.at is not None:
+            start = datetime.combine(first_day, task.at)
+            if task.day is None and start < now:
+                start += timedelta(days=1)
+            conflict = not index.is_free(start, start + duration)
+            item.update(start=start, end=start + duration, fixed=True, conflict=conflict, score=None,
+                        reasons=["пересекается с другими делами"] if conflict else ["время указано в задаче"])
+        else:
+            best = _best_start(index, task, first_day, first_day + timedelta(days=horizon_days - 1),
+                               duration, hours, now)
+            if best is None:
+                unplaced.append({"index": i, "title": task.title,
+                                 "reason": f"нет свободного окна на {task.duration_minutes} мин. "
+                                           f"в ближайшие {horizon_days} дн."})
+                continue
+            score, start, reasons = best
+            item.update(start=start, end=start + duration, fixed=False, conflict=False, score=score,
+                        reasons=reasons)
+
+        index.add(item["start"], item["end"])
+        plan.append(item)
+
+    plan.sort(key=lambda p: (p["start"], p["index"]))
+    unplaced.sort(key=lambda u: u["index"])
+    return {"plan": plan, "unplaced": unplaced}
+
+def serialize_plan(result: Dict[str, list]) -> Dict[str, list]:
+    return {
+        "plan": [
+            dict(item, start=item["start"].isoformat(timespec="minutes"), end=item["end"].isoformat(timespec="minutes"))
+            for item in result["plan"]
+        ],
+        "unplaced": result["unplaced"],
+    }
+
+def plan_for_user(db, user_id: int, tasks: List[BatchTask], start_day: date,
+                  horizon_days: int = BATCH_HORIZON_DAYS) -> Dict[str, list]:
+    horizon_days = max(1, min(horizon_days, SLOT_SEARCH_MAX_DAYS))
+    last_day = max(max(t.day or start_day, start_day) for t in tasks) + timedelta(days=horizon_days - 1)
+    return serialize_plan(plan_batch(
+        tasks,
+        events_in_range(db, user_id, start_day, last_day),
+        start_day,
+        horizon_days,
+        working_hours_for(db, user_id),
+    ))
+
+def plan_message(db, user_id: int, message: str) -> Optional[Dict[str, list]]:
+    if len(split_tasks(message)) < 2:
+        return None
+    tasks = tasks_from_text(message)[:BATCH_MAX_TASKS]
+    if len(tasks) < 2:
+        return None
+    return plan_for_user(db, user_id, tasks, datetime.now().date())
+
+def commit_plan(db, user_id: int, plan: List[dict], allow_conflicts: bool = False, delay: Optional[float] = None):
+    from backend.database import Event
+    if not plan:
+        return [], []
+
+    slots = sorted(
+        ((datetime.fromisoformat(item["start"]), datetime.fromisoformat(item["end"]), item) for item in plan),
+        key=lambda s: s[0],
+    )
+    index = None
+    if not allow_conflicts:
+        index = AvailabilityIndex(
+            events_in_range(db, user_id, slots[0][0].date(), max(end for _, end, _ in slots).date()),
+            working_hours_for(db, user_id).buffer_minutes,
+        )
+
+    new_events = []
+    skipped = []
+    for start, end, item in slots:
+        if index is not None:
+            if not index.is_free(start, end):
+                skipped.append(dict(item, conflict=True))
+                continue
+            index.add(start, end)
+        new_events.append(Event(
+            user_id=user_id,
+            title=item["title"],
+            description=item.get("description") or "",
+            start_time=start,
+            end_time=end,
+            source="ai_assistant",
+            view=item["category"]
+        ))
+    skipped.sort(key=lambda item: item["index"])
+    if not new_events:
+        return [], skipped
+
+    try:
+        db.add_all(new_events)
+        db.flush()
+        event_ids = [ev.id for ev in new_events]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    sync_scheduler.request_sync(user_id, upsert_event_ids=event_ids, delay=delay)
+    return event_ids, skipped
+
+def plan_summary(body: Dict[str, list]) -> str:
+    lines = [f"Предлагаю распланировать задачи ({len(body['plan'])}):"]
+    for item in body["plan"]:
+        start = datetime.fromisoformat(item["start"])
+        end = datetime.fromisoformat(item["end"])
+        line = f"• {start.strftime('%d.%m %H:%M')}–{end.strftime('%H:%M')} — {item['title']}"
+        if item.get("conflict"):
+            line += " ⚠️ пересекается с другими делами, не будет добавлено"
+        lines.append(line)
+    if body["unplaced"]:
+        lines.append("Не нашлось времени: " + ", ".join(u["title"] for u in body["unplaced"]))
+    lines.append("Ответь «да», чтобы добавить всё.")
+    return "\n".join(lines)
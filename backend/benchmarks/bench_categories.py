@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.ai import CATEGORY_KEYWORDS, auto_assign_categories, auto_assign_category
+
+EVENTS = int(os.getenv("BENCH_EVENTS", "100000"))
+
+CORPUS = [
+    ("Созвон с клиентом", "обсудить контракт"),
+    ("Совещание", "Сгенерировано из заметки: 'совещание с командой завтра в 11:00'"),
+    ("Купить продукты", ""),
+    ("Купить цветы маме", "на день рождения"),
+    ("Доделать презентацию", "к пятнице, срочно"),
+    ("Паспорт", "сделать в конце месяца"),
+    ("Зубной", "запись к стоматологу"),
+    ("Встреча с друзьями", "в кафе"),
+    ("Сдать отчёт", ""),
+    ("К врачу", "через неделю"),
+    ("Забрать посылку", "доставка до пункта выдачи"),
+    ("Тренировка", "в зале в 19:00"),
+    ("Планерка", "в следующий понедельник"),
+    ("День рождения брата", ""),
+    ("Оплатить счета", "до 25-го"),
+    ("Плавание", ""),
+    ("Позвонить маме", ""),
+    ("Выпить таблетки", "после еды"),
+    ("Йога", ""),
+    ("Экзамен", "по математике"),
+    ("Записаться к стоматологу", ""),
+    ("Уборка", "в субботу"),
+    ("Лекция", "во вторник"),
+    ("Пары в университете", ""),
+    ("Домашнее задание", "по математике"),
+    ("Поход в кино", "с семьей"),
+    ("Ремонт", "вызвать мастера домой"),
+    ("Заказать одежду", "на распродаже"),
+    ("Свидание", "в театре"),
+    ("", ""),
+]
+
+def legacy_assign_category(title: str, description: str = "") -> str:
+    text = f"{title} {description}".lower().strip()
+    if not text:
+        return "Личное"
+    scores = {}
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        score = 0
+        for keyword in keywords:
+            kw = keyword.lower()
+            score += text.count(kw)
+            if f" {kw} " in f" {text} ":
+                score += 2
+        scores[category] = score
+    best_category, best_score = max(scores.items(), key=lambda x: x[1])
+    if best_score <= 0:
+        return "Личное"
+    return best_category
+
+def _rate(fn, pairs):
+    start = time.perf_counter()
+    fn(pairs)
+    return len(pairs) / (time.perf_counter() - start)
+
+def main():
+    repeated = (CORPUS * (EVENTS // len(CORPUS) + 1))[:EVENTS]
+    unique = [(title, f"{description} #{i}") for i, (title, description) in enumerate(repeated)]
+
+    differs = 0
+    for title, description in CORPUS:
+        old = legacy_assign_category(title, description)
+        new = auto_assign_category(title, description)
+        if old != new:
+            differs += 1
+            print(f"  differs: {title!r} / {description!r}: legacy={old} compiled={new}")
+    batch = auto_assign_categories(CORPUS)
+    assert batch == [auto_assign_category(t, d) for t, d in CORPUS], "batch and single results disagree"
+
+    legacy = _rate(lambda ps: [legacy_assign_category(t, d) for t, d in ps], unique)
+    single = _rate(lambda ps: [auto_assign_category(t, d) for t, d in ps], unique)
+    many = _rate(auto_assign_categories, unique)
+    many_repeated = _rate(auto_assign_categories, repeated)
+
+    print(f"corpus: {len(CORPUS)} events, classified differently from legacy: {differs}")
+    print(f"legacy keyword loop:    {legacy:12,.0f} events/s")
+    print(f"compiled, per event:    {single:12,.0f} events/s ({single / legacy:.1f}x)")
+    print(f"compiled, batch:        {many:12,.0f} events/s ({many / legacy:.1f}x)")
+    print(f"batch, repeated titles: {many_repeated:12,.0f} events/s ({many_repeated / legacy:.1f}x)")
+
+if __name__ == "__main__":
+    main()
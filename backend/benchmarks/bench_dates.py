@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.ai_parser import _dateparser_date, fast_parse_date
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+
+# Hand-written phrases, not sampled from real user messages: hit rates are only indicative.
+SYNTHETIC_CORPUS = [
+    "завтра в 10 созвон",
+    "завтра в 10:00 созвон по работе",
+    "купить продукты",
+    "купить продукты сегодня вечером",
+    "послезавтра сходить в аптеку",
+    "совещание с командой завтра в 11:00",
+    "купить цветы маме на др 12 марта",
+    "срочно! доделать презентацию к пятнице",
+    "паспорт сделать в конце месяца",
+    "зубной в четверг запись",
+    "в пятницу встреча с друзьями в кафе",
+    "через 3 дня сдать отчет",
+    "через неделю к врачу",
+    "через два дня забрать посылку",
+    "тренировка в среду в 19:00",
+    "в следующий понедельник планерка",
+    "15.11 день рождения брата",
+    "оплатить счета до 25.10.2026",
+    "хочу поплавать",
+    "надо позвонить маме",
+    "напомни выпить таблетки в 21:00",
+    "сегодня в 18:30 йога",
+    "экзамен 20 декабря",
+    "записаться к стоматологу",
+    "в субботу уборка",
+    "во вторник в 9:00 лекция",
+    "пары в университете",
+    "привет",
+    "как дела?",
+    "сделать домашнее задание по математике",
+    "на 12.10 созвон",
+    "встреча 5.10",
+]
+
+def _time_it(fn, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            fn(t)
+    return (time.perf_counter() - start) / (rounds * len(texts))
+
+def _combined(text):
+    return fast_parse_date(text) or _dateparser_date(text)
+
+def main():
+    today = date.today()
+    _dateparser_date("завтра")
+
+    fast_hits = sum(1 for t in SYNTHETIC_CORPUS if fast_parse_date(t, today) is not None)
+    agree = disagree = 0
+    for t in SYNTHETIC_CORPUS:
+        fast = fast_parse_date(t, today)
+        if fast is None:
+            continue
+        slow = _dateparser_date(t)
+        if slow is None or slow == fast:
+            agree += 1
+        else:
+            disagree += 1
+            print(f"  differs: {t!r}: fast={fast} dateparser={slow}")
+
+    slow_mean = _time_it(_dateparser_date, SYNTHETIC_CORPUS, ROUNDS)
+    fast_mean = _time_it(fast_parse_date, SYNTHETIC_CORPUS, ROUNDS * 20)
+    combined_mean = _time_it(_combined, SYNTHETIC_CORPUS, ROUNDS)
+
+    print(f"synthetic corpus: {len(SYNTHETIC_CORPUS)} messages, fast-path hits: {fast_hits} ({fast_hits / len(SYNTHETIC_CORPUS):.0%})")
+    print(f"fast hits matching or extending dateparser: {agree}, differing: {disagree}")
+    print(f"dateparser only:        {slow_mean * 1e6:10.1f} us/message")
+    print(f"fast path only:         {fast_mean * 1e6:10.1f} us/message")
+    print(f"fast path + fallback:   {combined_mean * 1e6:10.1f} us/message ({slow_mean / combined_mean:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import tempfile
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DURATION = float(os.getenv("BENCH_SECONDS", "5"))
+READERS = int(os.getenv("BENCH_READERS", "2"))
+
+def _worker(role: str, db_url: str, profile: str, user_id: int, results):
+    os.environ["DATABASE_URL"] = db_url
+    os.environ["SQLITE_PROFILE"] = profile
+    sys.path.insert(0, ROOT)
+
+    from sqlalchemy.exc import OperationalError
+    from backend.database import SessionLocal, Event
+
+    writes = reads = locked = 0
+    latencies = []
+    deadline = time.monotonic() + DURATION
+    day = datetime(2026, 1, 1)
+
+    while time.monotonic() < deadline:
+        db = SessionLocal()
+        started = time.perf_counter()
+        try:
+            if role == "reader":
+                db.query(Event).filter(
+                    Event.user_id == user_id,
+                    Event.start_time >= day,
+                    Event.start_time < day + timedelta(days=30),
+                ).order_by(Event.start_time.desc()).limit(50).all()
+                reads += 1
+            else:
+                db.add(Event(user_id=user_id, title=f"{role} {writes}", description="",
+                             start_time=day + timedelta(minutes=writes),
+                             end_time=day + timedelta(minutes=writes + 30), source="local"))
+                db.commit()
+                writes += 1
+            latencies.append(time.perf_counter() - started)
+        except OperationalError as exc:
+            db.rollback()
+            if "locked" in str(exc):
+                locked += 1
+            else:
+                raise
+        finally:
+            db.close()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+    results.put((role, writes, reads, locked, p99))
+
+def run_profile(profile: str) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db_url = f"sqlite:///{path}"
+
+    os.environ["DATABASE_URL"] = db_url
+    sys.path.insert(0, ROOT)
+    from backend.database import Base
+    from sqlalchemy import create_engine, text
+    setup_engine = create_engine(db_url)
+    Base.metadata.create_all(setup_engine)
+    with setup_engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id) VALUES (1), (2)"))
+    setup_engine.dispose()
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    roles = [("api", 1), ("bot", 2)] + [("reader", 1)] * READERS
+    procs = [ctx.Process(target=_worker, args=(role, db_url, profile, uid, results)) for role, uid in roles]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+    return {
+        "writes": sum(r[1] for r in rows),
+        "reads": sum(r[2] for r in rows),
+        "locked": sum(r[3] for r in rows),
+        "p99_ms": max(r[4] for r in rows) * 1000,
+    }
+
+if __name__ == "__main__":
+    print(f"api + bot писатели, {READERS} читателя, {DURATION:.0f} с на профиль")
+    for profile in ("default", "tuned"):
+        r = run_profile(profile)
+        print(f"{profile:<8} writes={r['writes']:<7} reads={r['reads']:<7} "
+              f"locked={r['locked']:<5} p99={r['p99_ms']:.1f} ms")
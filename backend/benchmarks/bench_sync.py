@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from backend.database import Base, Event, User
+from backend.google_calendar import _apply_google_items, _dt_from_google
+
+EVENTS_PER_USER = int(os.getenv("BENCH_EVENTS", "5000"))
+USER_ID = 1
+
+def _google_items(n: int, changed_every: int = 50, cancelled_every: int = 97) -> list[dict]:
+    base = datetime(2026, 1, 1, 9, 0)
+    items = []
+    for i in range(n):
+        start = base + timedelta(hours=i)
+        title = f"Событие {i}" + (" (изм.)" if i % changed_every == 0 else "")
+        items.append({
+            "id": f"g{i}",
+            "summary": title,
+            "description": "",
+            "start": {"dateTime": start.isoformat() + "+03:00"},
+            "end": {"dateTime": (start + timedelta(hours=1)).isoformat() + "+03:00"},
+            "status": "cancelled" if i % cancelled_every == 0 else "confirmed",
+        })
+    return items
+
+def _seed(engine, n: int):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(user_id=USER_ID))
+        base = datetime(2026, 1, 1, 9, 0)
+        db.add_all(
+            Event(
+                user_id=USER_ID,
+                title=f"Событие {i}",
+                description="",
+                start_time=base + timedelta(hours=i),
+                end_time=base + timedelta(hours=i + 1),
+                external_id=f"g{i}",
+                source="google",
+            )
+            for i in range(n)
+        )
+        db.commit()
+
+def _legacy_apply(db: Session, user_id: int, google_events: list[dict]):
+    google_ids = set()
+    for ge in google_events:
+        gid = ge["id"]
+        google_ids.add(gid)
+        local = db.scalar(select(Event).where(Event.external_id == gid, Event.user_id == user_id))
+        if ge.get("status") == "cancelled":
+            if local:
+                db.delete(local)
+            continue
+        start_dt = _dt_from_google(ge["start"]["dateTime"])
+        end_dt = _dt_from_google(ge["end"]["dateTime"])
+        title = ge.get("summary", "Без названия")
+        if not local:
+            db.add(Event(user_id=user_id, title=title, description="", start_time=start_dt,
+                         end_time=end_dt, external_id=gid, source="google"))
+        elif local.title != title or local.start_time != start_dt or local.end_time != end_dt:
+            local.title = title
+            local.start_time = start_dt
+            local.end_time = end_dt
+    for e in db.scalars(select(Event).where(Event.user_id == user_id, Event.external_id.is_not(None))).all():
+        if e.external_id not in google_ids:
+            db.delete(e)
+
+def _run(engine, label: str, fn, items: list[dict]) -> float:
+    _seed(engine, EVENTS_PER_USER)
+    with Session(engine) as db:
+        start = time.perf_counter()
+        fn(db, items)
+        db.commit()
+        elapsed = time.perf_counter() - start
+        remaining = db.query(Event).count()
+    print(f"{label:<10} {elapsed * 1000:9.1f} ms  ({remaining} событий после синхронизации)")
+    return elapsed
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite:///:memory:")
+    items = _google_items(EVENTS_PER_USER)
+    print(f"{EVENTS_PER_USER} событий на пользователя, full sync")
+    legacy = _run(engine, "legacy", lambda db, it: _legacy_apply(db, USER_ID, it), items)
+    current = _run(engine, "preload", lambda db, it: _apply_google_items(db, USER_ID, it, True), items)
+    print(f"ускорение: x{legacy / current:.1f}")
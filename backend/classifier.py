@@ -0,0 +1,71 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+MIN_STEM_LENGTH = 5
+
+_ENDINGS = (
+    "ями", "ами", "иям", "иях", "ией",
+    "ов", "ев", "ей", "ой", "ий", "ый", "ая", "ое", "ые", "ие", "ом", "ем", "ам", "ям", "ах", "ях", "ию", "ия",
+    "а", "я", "ы", "и", "у", "ю", "е", "о", "ь",
+)
+_ENDING_SET = frozenset(_ENDINGS) | {""}
+
+def stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+def normalize(text: str) -> str:
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+def keyword_stem(keyword: str) -> str:
+    words = normalize(keyword).split()
+    if not words:
+        return ""
+    return " ".join(words[:-1] + [stem(words[-1])])
+
+def trie_pattern(words: Iterable[str]) -> str:
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+class KeywordScanner:
+    def __init__(self, keys: Iterable[str]):
+        keys = {key for key in keys if key}
+        self._prefixes: Dict[str, Tuple[str, ...]] = {
+            key: tuple(other for other in keys if key.startswith(other)) for key in keys
+        }
+        self._pattern = re.compile("(?=(" + trie_pattern(keys) + "))")
+
+    def scan(self, text: str) -> Dict[str, List[int]]:
+        hits: Dict[str, List[int]] = {}
+        prefixes = self._prefixes
+        for m in self._pattern.finditer(text):
+            pos = m.start()
+            at_word_start = pos == 0 or not text[pos - 1].isalpha()
+            for key in prefixes[m.group(1)]:
+                hit = hits.get(key)
+                if hit is None:
+                    hit = hits[key] = [0, False]
+                hit[0] += 1
+                if at_word_start and not hit[1]:
+                    end = tail_end = pos + len(key)
+                    while tail_end < len(text) and text[tail_end].isalpha():
+                        tail_end += 1
+                    hit[1] = text[end:tail_end] in _ENDING_SET
+        return hits
@@ -2,18 +2,31 @@ from __future__ import annotations
 
 import os
 import json
+import time
+import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from sqlalchemy import (
-    create_engine, Integer, String, DateTime, Text, ForeignKey, text
+    create_engine, event, Integer, String, DateTime, Text, ForeignKey, Index, text
 )
 from sqlalchemy.orm import (
     declarative_base, sessionmaker, relationship, Session, Mapped, mapped_column
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 Base = declarative_base()
 
 class User(Base):
@@ -21,9 +34,13 @@ class User(Base):
 
     user_id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     created_at = mapped_column(DateTime(timezone=True), server_default=func.now())
+    work_start = mapped_column(String(5), nullable=True)
+    work_end = mapped_column(String(5), nullable=True)
+    buffer_minutes = mapped_column(Integer, nullable=True)
 
     tokens = relationship("OAuthToken", back_populates="user", cascade="all,delete-orphan")
     events = relationship("Event", back_populates="user", cascade="all,delete-orphan")
+    sync_states = relationship("SyncState", back_populates="user", cascade="all,delete-orphan")
 
 class OAuthToken(Base):
     __tablename__ = "oauth_tokens"
@@ -35,6 +52,25 @@ class OAuthToken(Base):
 
     user = relationship("User", back_populates="tokens")
 
+    __table_args__ = (
+        Index("uq_oauth_tokens_user_provider", "user_id", "provider", unique=True),
+    )
+
+class SyncState(Base):
+    __tablename__ = "sync_states"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"))
+    provider: Mapped[str] = mapped_column(String(50))
+    sync_token: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    user = relationship("User", back_populates="sync_states")
+
+    __table_args__ = (
+        Index("uq_sync_states_user_provider", "user_id", "provider", unique=True),
+    )
+
 class Event(Base):
     __tablename__ = "events"
 
@@ -50,15 +86,175 @@ class Event(Base):
 
     user = relationship("User", back_populates="events")
 
+    __table_args__ = (
+        Index("ix_events_user_start", "user_id", "start_time"),
+        Index("uq_events_user_external", "user_id", "external_id", unique=True),
+        Index("ix_events_user_view", "user_id", "view"),
+    )
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned").lower()
+
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "temp_store": "MEMORY",
+}
+
+def _apply_sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_SLOW_CHECKOUT_MS = float(os.getenv("DB_POOL_SLOW_CHECKOUT_MS", "100"))
+DB_PG_PREPARE_THRESHOLD = os.getenv("DB_PG_PREPARE_THRESHOLD")
+
+class _PoolWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if timed_out:
+                self.timeouts += 1
+            if waited * 1000 >= DB_POOL_SLOW_CHECKOUT_MS:
+                self.slow_checkouts += 1
+        if waited * 1000 >= DB_POOL_SLOW_CHECKOUT_MS:
+            logger.warning("Slow DB pool checkout: %.1f ms", waited * 1000)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else None,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+POOL_WAIT_STATS = _PoolWaitStats()
+
+class TimedQueuePool(QueuePool):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            conn = super().connect()
+        except SATimeoutError:
+            POOL_WAIT_STATS.record(time.perf_counter() - started, timed_out=True)
+            raise
+        POOL_WAIT_STATS.record(time.perf_counter() - started)
+        return conn
+
+def make_engine(url: str = DATABASE_URL):
+    sa_url = make_url(url)
+
+    if sa_url.drivername.startswith("sqlite"):
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if sa_url.database and sa_url.database != ":memory:":
+            kwargs["poolclass"] = TimedQueuePool
+        sqlite_engine = create_engine(url, **kwargs)
+        if SQLITE_PROFILE == "tuned":
+            event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+        return sqlite_engine
+
+    connect_args = {}
+    if sa_url.drivername == "postgresql+psycopg" and DB_PG_PREPARE_THRESHOLD is not None:
+        threshold = DB_PG_PREPARE_THRESHOLD.strip().lower()
+        connect_args["prepare_threshold"] = None if threshold in ("", "none", "off") else int(threshold)
+
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+
+engine = make_engine(DATABASE_URL)
+
+def _async_url(url: str):
+    sa_url = make_url(url)
+    backend_name = sa_url.get_backend_name()
+    if backend_name == "sqlite":
+        return sa_url.set(drivername="sqlite+aiosqlite")
+    if backend_name == "postgresql":
+        return sa_url.set(drivername="postgresql+asyncpg")
+    return sa_url
+
+def make_async_engine(url: str = DATABASE_URL):
+    sa_url = _async_url(url)
+
+    if sa_url.get_backend_name() == "sqlite":
+        sqlite_engine = create_async_engine(sa_url)
+        if SQLITE_PROFILE == "tuned":
+            event.listen(sqlite_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        return sqlite_engine
+
+    return create_async_engine(
+        sa_url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+try:
+    async_engine = make_async_engine(DATABASE_URL)
+except ImportError:
+    async_engine = None
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+AsyncSessionLocal = (
+    async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    if async_engine is not None else None
+)
+
+def pool_metrics() -> dict:
+    stats = POOL_WAIT_STATS.snapshot()
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "idle": pool.checkedin(),
+        })
+    return stats
+
+_creds_listeners: list = []
+
+KNOWN_USERS_CACHE_SIZE = int(os.getenv("KNOWN_USERS_CACHE_SIZE", "10000"))
+
+_known_users: "OrderedDict[int, None]" = OrderedDict()
+_known_users_lock = threading.Lock()
+
+def on_creds_changed(callback):
+    _creds_listeners.append(callback)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -66,73 +262,122 @@ def get_db():
     finally:
         db.close()
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
-
-    ensure_view_column()
-
-def ensure_view_column():
-    
-    try:
-        with engine.begin() as conn:
-
-            res = conn.execute(text("PRAGMA table_info('events')")).fetchall()
-            cols = [r[1] for r in res] if res else []
-            if 'view' in cols:
-                return
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("async database driver is not installed (aiosqlite / asyncpg)")
+    async with AsyncSessionLocal() as db:
+        yield db
 
-            if engine.url.drivername.startswith('sqlite'):
-                conn.execute(text("ALTER TABLE events ADD COLUMN view VARCHAR(50)"))
-            else:
+def create_tables():
+    from backend.migrations import run_migrations
 
-                conn.execute(text("ALTER TABLE events ADD COLUMN view VARCHAR(50) NULL"))
-    except Exception:
+    Base.metadata.create_all(bind=engine)
 
-        pass
+    run_migrations(engine)
 
-def get_user_creds(user_id: int) -> Credentials | None:
+def _creds_from_row(row) -> Credentials | None:
+    if not row:
+        return None
     try:
         from google.oauth2.credentials import Credentials
     except Exception:
-        Credentials = None
+        return None
+    return Credentials.from_authorized_user_info(json.loads(row[0]))
 
+def get_user_creds(user_id: int) -> Credentials | None:
     with engine.begin() as conn:
         row = conn.execute(
             text("SELECT token_json FROM oauth_tokens WHERE user_id = :uid AND provider = 'google'"),
             {"uid": user_id}
         ).fetchone()
 
-    if not row:
-        return None
+    return _creds_from_row(row)
 
-    if Credentials is None:
-        return None
+def _insert_for(dialect_name: str):
+    if dialect_name == "postgresql":
+        return pg_insert
+    return sqlite_insert
 
-    return Credentials.from_authorized_user_info(json.loads(row[0]))
+def _user_insert_stmt(dialect_name: str, user_id: int):
+    return (
+        _insert_for(dialect_name)(User.__table__)
+        .values(user_id=user_id)
+        .on_conflict_do_nothing(index_elements=["user_id"])
+    )
+
+def _provider_upsert_stmt(dialect_name: str, model, user_id: int, provider: str, **values):
+    return (
+        _insert_for(dialect_name)(model.__table__)
+        .values(user_id=user_id, provider=provider, **values)
+        .on_conflict_do_update(index_elements=["user_id", "provider"], set_=values)
+    )
+
+def _is_known_user(user_id: int) -> bool:
+    with _known_users_lock:
+        if user_id in _known_users:
+            _known_users.move_to_end(user_id)
+            return True
+    return False
+
+def _remember_user(user_id: int):
+    with _known_users_lock:
+        _known_users[user_id] = None
+        _known_users.move_to_end(user_id)
+        while len(_known_users) > KNOWN_USERS_CACHE_SIZE:
+            _known_users.popitem(last=False)
 
 def ensure_user_exists(user_id: int):
+    if _is_known_user(user_id):
+        return
     with engine.begin() as conn:
-        existing = conn.execute(
-            text("SELECT user_id FROM users WHERE user_id = :uid"),
-            {"uid": user_id}
-        ).fetchone()
-        if not existing:
-            conn.execute(
-                text("INSERT INTO users (user_id) VALUES (:uid)"),
-                {"uid": user_id}
-            )
+        conn.execute(_user_insert_stmt(engine.dialect.name, user_id))
+    _remember_user(user_id)
 
 def save_user_creds(user_id: int, creds: Credentials):
     ensure_user_exists(user_id)
-    token_json = creds.to_json()
     with engine.begin() as conn:
-        updated = conn.execute(
-            text("UPDATE oauth_tokens SET token_json = :t WHERE user_id = :u AND provider = 'google'"),
-            {"u": user_id, "t": token_json}
-        )
-
-        if updated.rowcount == 0:
-            conn.execute(
-                text("INSERT INTO oauth_tokens (user_id, provider, token_json) VALUES (:u, 'google', :t)"),
-                {"u": user_id, "t": token_json}
-            )
+        conn.execute(_provider_upsert_stmt(
+            engine.dialect.name, OAuthToken, user_id, "google", token_json=creds.to_json()
+        ))
+
+    for callback in _creds_listeners:
+        callback(user_id)
+
+def get_sync_token(user_id: int, provider: str = "google") -> str | None:
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT sync_token FROM sync_states WHERE user_id = :u AND provider = :p"),
+            {"u": user_id, "p": provider}
+        ).fetchone()
+    return row[0] if row else None
+
+def save_sync_token(user_id: int, sync_token: str | None, provider: str = "google"):
+    with engine.begin() as conn:
+        conn.execute(_provider_upsert_stmt(
+            engine.dialect.name, SyncState, user_id, provider, sync_token=sync_token, updated_at=func.now()
+        ))
+
+async def get_user_creds_async(user_id: int) -> Credentials | None:
+    async with async_engine.begin() as conn:
+        row = (await conn.execute(
+            text("SELECT token_json FROM oauth_tokens WHERE user_id = :uid AND provider = 'google'"),
+            {"uid": user_id}
+        )).fetchone()
+    return _creds_from_row(row)
+
+async def ensure_user_exists_async(user_id: int):
+    if _is_known_user(user_id):
+        return
+    async with async_engine.begin() as conn:
+        await conn.execute(_user_insert_stmt(async_engine.dialect.name, user_id))
+    _remember_user(user_id)
+
+async def save_user_creds_async(user_id: int, creds: Credentials):
+    await ensure_user_exists_async(user_id)
+    async with async_engine.begin() as conn:
+        await conn.execute(_provider_upsert_stmt(
+            async_engine.dialect.name, OAuthToken, user_id, "google", token_json=creds.to_json()
+        ))
+
+    for callback in _creds_listeners:
+        callback(user_id)
@@ -0,0 +1,130 @@
+import os
+import re
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+try:
+    from backend.ai_prompt import PROMPT_VERSION
+except Exception:
+    from ai_prompt import PROMPT_VERSION
+
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "5000"))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", "21600"))
+EXTRACTION_CACHE_DB = os.getenv("EXTRACTION_CACHE_DB", "")
+
+_WS_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n.,!?;:…\"'«»"
+
+def normalize_text(text: str) -> str:
+    text = (text or "").lower().replace("ё", "е")
+    return _WS_RE.sub(" ", text).strip(_EDGE_PUNCT)
+
+def _next_midnight(today: date) -> float:
+    return datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+
+class ExtractionCache:
+    def __init__(self, max_size: int = EXTRACTION_CACHE_SIZE, ttl: float = EXTRACTION_CACHE_TTL,
+                 db_path: str = EXTRACTION_CACHE_DB):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (time.time(),))
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, text: str, today: Optional[date] = None) -> str:
+        today = today or date.today()
+        raw = f"{PROMPT_VERSION}|{today.isoformat()}|{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, today: Optional[date] = None) -> Optional[dict]:
+        key = self.key(text, today)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM extraction_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._store_locked(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(value)
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, value: dict, today: Optional[date] = None):
+        today = today or date.today()
+        key = self.key(text, today)
+        expires_at = min(time.time() + self.ttl, _next_midnight(today))
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store_locked(key, expires_at, value)
+            self.stores += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                if self.stores % 500 == 0:
+                    self._db.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (time.time(),))
+
+    def _store_locked(self, key: str, expires_at: float, value: dict):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM extraction_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "persistent": self._db is not None,
+            }
+
+extraction_cache = ExtractionCache()
@@ -1,33 +1,98 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete
 
-from backend.database import engine, Event, get_user_creds
+from backend.database import engine, Event, get_user_creds, get_sync_token, save_sync_token, on_creds_changed
 
 TIMEZONE = "Europe/Moscow"
+PAGE_SIZE = 250
+BATCH_SIZE = 50
+DELETE_CHUNK = 500
+
+CREDS_CACHE_TTL = float(os.getenv("GOOGLE_CREDS_CACHE_TTL", "600"))
+CREDS_CACHE_SIZE = int(os.getenv("GOOGLE_CREDS_CACHE_SIZE", "256"))
+
+_creds_cache: "OrderedDict[int, tuple[float, object]]" = OrderedDict()
+_creds_lock = threading.Lock()
+_discovery_doc = None
+
+def _calendar_discovery_doc() -> Optional[dict]:
+    global _discovery_doc
+    if _discovery_doc is None:
+        doc = get_static_doc("calendar", "v3")
+        _discovery_doc = json.loads(doc) if doc else {}
+    return _discovery_doc or None
+
+def _build_service(creds):
+    doc = _calendar_discovery_doc()
+    if doc:
+        return build_from_document(doc, credentials=creds)
+    return build("calendar", "v3", credentials=creds)
+
+def invalidate_service(user_id: int):
+    with _creds_lock:
+        _creds_cache.pop(user_id, None)
+
+on_creds_changed(invalidate_service)
+
+def _cached_creds(user_id: int):
+    now = time.monotonic()
+    with _creds_lock:
+        cached = _creds_cache.get(user_id)
+        if cached and cached[0] > now:
+            _creds_cache.move_to_end(user_id)
+            return cached[1]
 
-def _service(user_id: int):
     creds = get_user_creds(user_id)
     if not creds:
+        invalidate_service(user_id)
         return None
-    return build("calendar", "v3", credentials=creds)
 
-def create_google_event(user_id: int, event_data: dict) -> Optional[str]:
-    svc = _service(user_id)
-    if not svc:
-        return None
+    with _creds_lock:
+        _creds_cache[user_id] = (now + CREDS_CACHE_TTL, creds)
+        _creds_cache.move_to_end(user_id)
+        while len(_creds_cache) > CREDS_CACHE_SIZE:
+            _creds_cache.popitem(last=False)
+    return creds
 
-    body = {
+def _service(user_id: int):
+    # A Resource wraps one httplib2.Http, which is not thread-safe, so each call gets its own.
+    creds = _cached_creds(user_id)
+    return _build_service(creds) if creds else None
+
+def _event_body(event_data: dict) -> dict:
+    return {
         "summary": event_data.get("title") or "Без названия",
         "description": event_data.get("description", ""),
         "start": {"dateTime": event_data["start"], "timeZone": TIMEZONE},
         "end": {"dateTime": event_data["end"], "timeZone": TIMEZONE},
     }
 
+def _local_event_data(event: Event) -> dict:
+    return {
+        "title": event.title,
+        "description": event.description or "",
+        "start": event.start_time.isoformat(),
+        "end": event.end_time.isoformat(),
+    }
+
+def create_google_event(user_id: int, event_data: dict) -> Optional[str]:
+    svc = _service(user_id)
+    if not svc:
+        return None
+
+    body = _event_body(event_data)
+
     try:
         created = svc.events().insert(calendarId="primary", body=body).execute()
         return created.get("id")
@@ -63,157 +128,281 @@ def upsert_google_event(user_id: int, event: Event) -> Optional[str]:
         if ok:
             return event.external_id
 
-    gid = create_google_event(
-        user_id,
-        {
-            "title": event.title,
-            "description": event.description or "",
-            "start": event.start_time.isoformat(),
-            "end": event.end_time.isoformat(),
-        }
-    )
+    gid = create_google_event(user_id, _local_event_data(event))
     return gid
 
 def delete_google_event(user_id: int, event: Event):
+    _delete_google_event_raw(user_id, event.external_id)
+
+def _delete_google_event_raw(user_id: int, event_id: Optional[str]) -> bool:
     svc = _service(user_id)
-    if not svc or not event.external_id:
-        return
+    if not svc or not event_id:
+        return True
+    try:
+        svc.events().delete(calendarId="primary", eventId=event_id).execute()
+        return True
+    except HttpError as e:
+        return e.resp is not None and e.resp.status in (404, 410)
+
+def push_event_changes(user_id: int, upsert_event_ids=(), delete_external_ids=()) -> bool:
+    if not _service(user_id):
+        return True
+
+    ok = True
+    for gid in delete_external_ids:
+        if not _delete_google_event_raw(user_id, gid):
+            print(f"[sync] Ошибка удаления события {gid} из Google Calendar")
+            ok = False
+
+    if not upsert_event_ids:
+        return ok
+
+    db = Session(engine)
+    try:
+        events = db.scalars(
+            select(Event).where(Event.user_id == user_id, Event.id.in_(list(upsert_event_ids)))
+        ).all()
+
+        for ev in events:
+            try:
+                gid = upsert_google_event(user_id, ev)
+            except Exception as ex:
+                print(f"[sync] Ошибка отправки события {ev.id} в Google Calendar: {ex}")
+                ok = False
+                continue
+            if gid and gid != ev.external_id:
+                ev.external_id = gid
+                ev.source = "google"
+
+        db.commit()
+        return ok
+    except Exception as e:
+        db.rollback()
+        print("[sync] ошибка отправки изменений:", e)
+        return False
+    finally:
+        db.close()
+
+def bulk_create_google_events(user_id: int, events: list, svc=None) -> dict[int, str]:
+    svc = svc or _service(user_id)
+    if not svc or not events:
+        return {}
+
+    created: dict[int, str] = {}
+
+    def _on_result(request_id, response, exception):
+        if exception is not None:
+            print(f"[sync] Ошибка создания события {request_id} в Google Calendar: {exception}")
+            return
+        gid = (response or {}).get("id")
+        if gid:
+            created[int(request_id)] = gid
+
+    for i in range(0, len(events), BATCH_SIZE):
+        batch = svc.new_batch_http_request(callback=_on_result)
+        for ev in events[i:i + BATCH_SIZE]:
+            batch.add(
+                svc.events().insert(calendarId="primary", body=_event_body(_local_event_data(ev))),
+                request_id=str(ev.id)
+            )
+        try:
+            batch.execute()
+        except Exception as ex:
+            print(f"[sync] Ошибка пакетной отправки в Google Calendar: {ex}")
+
+    return created
+
+def _push_unsynced_events(db: Session, user_id: int, svc=None) -> int:
+    pending = db.scalars(
+        select(Event).where(
+            Event.user_id == user_id,
+            Event.external_id.is_(None),
+            Event.source != "google"
+        )
+    ).all()
+
+    created = bulk_create_google_events(user_id, list(pending), svc)
+    for ev in pending:
+        gid = created.get(ev.id)
+        if gid:
+            ev.external_id = gid
+            ev.source = "google"
+    return len(created)
+
+def push_local_events(user_id: int) -> int:
+    db = Session(engine)
     try:
-        svc.events().delete(calendarId="primary", eventId=event.external_id).execute()
-    except HttpError:
-        pass
+        pushed = _push_unsynced_events(db, user_id)
+        db.commit()
+        return pushed
+    except Exception as e:
+        db.rollback()
+        print("[sync] ошибка отправки локальных событий:", e)
+        return 0
+    finally:
+        db.close()
 
 def _fetch_google_events_window(user_id: int) -> list[dict]:
-    svc = _service(user_id)
+    items, _, _ = _fetch_google_changes(user_id)
+    return items
+
+def _list_all_pages(svc, **params) -> tuple[list[dict], Optional[str]]:
+    items: list[dict] = []
+    page_token = None
+    while True:
+        response = svc.events().list(
+            calendarId="primary",
+            pageToken=page_token,
+            **params
+        ).execute()
+
+        items.extend(response.get("items", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items, response.get("nextSyncToken")
+
+def _fetch_google_changes(user_id: int, svc=None) -> tuple[list[dict], Optional[str], bool]:
+    svc = svc or _service(user_id)
     if not svc:
-        return []
+        return [], None, True
+
+    sync_token = get_sync_token(user_id)
+    if sync_token:
+        try:
+            items, next_token = _list_all_pages(
+                svc,
+                syncToken=sync_token,
+                singleEvents=True,
+                showDeleted=True,
+                maxResults=PAGE_SIZE,
+            )
+            return items, next_token, False
+        except HttpError as e:
+            if e.resp is None or e.resp.status != 410:
+                raise
+            print("[sync] syncToken устарел, выполняется полная синхронизация")
 
     time_min = (datetime.utcnow() - timedelta(days=30)).isoformat() + "Z"
     time_max = (datetime.utcnow() + timedelta(days=90)).isoformat() + "Z"
 
-    response = svc.events().list(
-        calendarId="primary",
+    items, next_token = _list_all_pages(
+        svc,
         timeMin=time_min,
         timeMax=time_max,
         singleEvents=True,
         showDeleted=True,
-        orderBy="updated",
-        maxResults=250,
-    ).execute()
-
-    return response.get("items", [])
+        maxResults=PAGE_SIZE,
+    )
+    return items, next_token, True
 
 def _dt_from_google(val: str) -> datetime:
     return datetime.fromisoformat(val.replace("Z", "+00:00"))
 
-def sync_google_calendar(user_id: int):
+def _same_time(a: Optional[datetime], b: datetime) -> bool:
+    if a is None:
+        return False
+    if (a.tzinfo is None) != (b.tzinfo is None):
+        return a.replace(tzinfo=None) == b.replace(tzinfo=None)
+    return a == b
+
+def _apply_google_items(db: Session, user_id: int, google_events: list[dict], full_sync: bool):
+    local_by_gid = {
+        row.external_id: row
+        for row in db.execute(
+            select(Event.id, Event.external_id, Event.title, Event.description, Event.start_time, Event.end_time)
+            .where(Event.user_id == user_id, Event.external_id.is_not(None))
+        )
+    }
+
+    google_ids = set()
+    doomed_ids: list[int] = []
+    inserts: dict[str, dict] = {}
+    updates: dict[int, dict] = {}
+
+    for ge in google_events:
+        gid = ge["id"]
+        google_ids.add(gid)
+        local = local_by_gid.get(gid)
+
+        if ge.get("status") == "cancelled":
+            if local:
+                doomed_ids.append(local.id)
+                updates.pop(local.id, None)
+            inserts.pop(gid, None)
+            continue
+
+        start = ge.get("start", {}).get("dateTime")
+        end = ge.get("end", {}).get("dateTime")
+        if not start or not end:
+            continue
+
+        title = ge.get("summary", "Без названия")
+        desc = ge.get("description") or ""
+        start_dt = _dt_from_google(start)
+        end_dt = _dt_from_google(end)
+
+        if not local:
+            inserts[gid] = {
+                "user_id": user_id,
+                "title": title,
+                "description": desc,
+                "start_time": start_dt,
+                "end_time": end_dt,
+                "external_id": gid,
+                "source": "google",
+            }
+        elif (
+            local.title != title
+            or (local.description or "") != desc
+            or not _same_time(local.start_time, start_dt)
+            or not _same_time(local.end_time, end_dt)
+        ):
+            updates[local.id] = {
+                "id": local.id,
+                "title": title,
+                "description": desc,
+                "start_time": start_dt,
+                "end_time": end_dt,
+            }
+
+    if full_sync:
+        doomed_ids.extend(row.id for gid, row in local_by_gid.items() if gid not in google_ids)
+
+    for i in range(0, len(doomed_ids), DELETE_CHUNK):
+        db.execute(
+            delete(Event)
+            .where(Event.user_id == user_id, Event.id.in_(doomed_ids[i:i + DELETE_CHUNK]))
+            .execution_options(synchronize_session=False)
+        )
+    if inserts:
+        db.execute(insert(Event), list(inserts.values()))
+    if updates:
+        db.execute(update(Event), list(updates.values()))
+
+def sync_google_calendar(user_id: int) -> bool:
     svc = _service(user_id)
     if not svc:
         print("[sync] пользователь не авторизован Google")
-        return
+        return True
 
     db = Session(engine)
     try:
-        google_events = _fetch_google_events_window(user_id)
-        google_ids = set()
+        google_events, next_sync_token, full_sync = _fetch_google_changes(user_id, svc)
+        _apply_google_items(db, user_id, google_events, full_sync)
 
-        for ge in google_events:
-            gid = ge["id"]
-            google_ids.add(gid)
-
-            title = ge.get("summary", "Без названия")
-            desc = ge.get("description") or ""
-            start = ge.get("start", {}).get("dateTime")
-            end = ge.get("end", {}).get("dateTime")
-            deleted = ge.get("status") == "cancelled"
-
-            local = db.scalar(
-                select(Event).where(Event.external_id == gid, Event.user_id == user_id)
-            )
-
-            if deleted:
-                if local:
-                    db.delete(local)
-                continue
-
-            if not start or not end:
-                continue
-
-            start_dt = _dt_from_google(start)
-            end_dt = _dt_from_google(end)
-
-            if not local:
-                db.add(Event(
-                    user_id=user_id,
-                    title=title,
-                    description=desc,
-                    start_time=start_dt,
-                    end_time=end_dt,
-                    external_id=gid,
-                    source="google"
-                ))
-            else:
-                changed = False
-                if local.title != title:
-                    local.title = title
-                    changed = True
-                if (local.description or "") != desc:
-                    local.description = desc
-                    changed = True
-                if local.start_time != start_dt or local.end_time != end_dt:
-                    local.start_time = start_dt
-                    local.end_time = end_dt
-                    changed = True
-
-                if changed:
-                    db.add(local)
-
-        local_events_with_external_id = db.scalars(
-            select(Event).where(
-                Event.user_id == user_id,
-                Event.external_id.is_not(None)
-            )
-        ).all()
-
-        for e in local_events_with_external_id:
-            if e.external_id not in google_ids:
-                db.delete(e)
-
-        local_events_without_external_id = db.scalars(
-            select(Event).where(
-                Event.user_id == user_id,
-                Event.external_id.is_(None)
-            )
-        ).all()
-
-        for e in local_events_without_external_id:
-
-            if e.source == "google":
-                continue
-
-            try:
-                gid = create_google_event(
-                    user_id,
-                    {
-                        "title": e.title,
-                        "description": e.description or "",
-                        "start": e.start_time.isoformat(),
-                        "end": e.end_time.isoformat(),
-                    }
-                )
-                if gid:
-                    e.external_id = gid
-                    e.source = "google"
-                    db.add(e)
-            except Exception as ex:
-                print(f"[sync] Ошибка создания события {e.id} в Google Calendar: {ex}")
+        _push_unsynced_events(db, user_id, svc)
 
         db.commit()
-        print("[sync] Google sync OK")
+
+        if next_sync_token:
+            save_sync_token(user_id, next_sync_token)
+        print(f"[sync] Google sync OK ({'full' if full_sync else 'incremental'}, {len(google_events)} изменений)")
+        return True
 
     except Exception as e:
         db.rollback()
         print("[sync] ошибка синхронизации:", e)
+        return False
 
     finally:
         db.close()
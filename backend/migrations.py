@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+def _add_event_view_column(conn: Connection):
+    cols = {c["name"] for c in inspect(conn).get_columns("events")}
+    if "view" not in cols:
+        conn.execute(text("ALTER TABLE events ADD COLUMN view VARCHAR(50)"))
+
+def _add_event_indexes(conn: Connection):
+    conn.execute(text(
+        "DELETE FROM events WHERE external_id IS NOT NULL AND id NOT IN ("
+        " SELECT keep_id FROM ("
+        "  SELECT MIN(id) AS keep_id FROM events"
+        "  WHERE external_id IS NOT NULL GROUP BY user_id, external_id"
+        " ) AS keep"
+        ")"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_user_start ON events (user_id, start_time)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_events_user_external ON events (user_id, external_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_user_view ON events (user_id, view)"))
+
+def _add_provider_unique_indexes(conn: Connection):
+    for table, index in (("oauth_tokens", "uq_oauth_tokens_user_provider"), ("sync_states", "uq_sync_states_user_provider")):
+        conn.execute(text(
+            f"DELETE FROM {table} WHERE id NOT IN ("
+            f" SELECT keep_id FROM ("
+            f"  SELECT MAX(id) AS keep_id FROM {table} GROUP BY user_id, provider"
+            f" ) AS keep"
+            f")"
+        ))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} (user_id, provider)"))
+
+def _add_user_working_hours(conn: Connection):
+    cols = {c["name"] for c in inspect(conn).get_columns("users")}
+    for name, ddl in (("work_start", "VARCHAR(5)"), ("work_end", "VARCHAR(5)"), ("buffer_minutes", "INTEGER")):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} {ddl}"))
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "events.view column", _add_event_view_column),
+    (2, "events (user_id, start_time), (user_id, external_id), (user_id, view) indexes", _add_event_indexes),
+    (3, "oauth_tokens / sync_states unique (user_id, provider)", _add_provider_unique_indexes),
+    (4, "users working hours and buffer", _add_user_working_hours),
+]
+
+def _current_version(engine: Engine) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar() or 0
+
+def run_migrations(engine: Engine) -> int:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            " version INTEGER PRIMARY KEY,"
+            " name VARCHAR(255) NOT NULL,"
+            " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+            ")"
+        ))
+
+    current = _current_version(engine)
+    for version, name, migrate in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        try:
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+                    {"v": version, "n": name}
+                )
+            print(f"[db] миграция {version} применена: {name}")
+        except Exception:
+            if _current_version(engine) < version:
+                raise
+        current = version
+
+    return current
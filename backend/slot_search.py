@@ -0,0 +1,211 @@
+import os
+import heapq
+import time
+import secrets
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional
+
+from backend.ai import TIME_PREFS_BY_CATEGORY, time_category
+from backend.availability import AvailabilityIndex, DEFAULT_HOURS, WorkingHours, to_local_naive, working_hours_for
+
+SLOT_SEARCH_TTL = float(os.getenv("SLOT_SEARCH_TTL", "600"))
+SLOT_SEARCH_CACHE_SIZE = int(os.getenv("SLOT_SEARCH_CACHE_SIZE", "1000"))
+SLOT_SEARCH_MAX_DAYS = int(os.getenv("SLOT_SEARCH_MAX_DAYS", "31"))
+SLOT_SEARCH_MAX_CANDIDATES = int(os.getenv("SLOT_SEARCH_MAX_CANDIDATES", "500"))
+SLOT_STEP_MINUTES = 30
+
+_PRIORITY_TARGET_HOUR = {"high": 9, "medium": 15, "low": 17}
+
+class CursorExpired(Exception):
+    pass
+
+class _SearchCache:
+    def __init__(self, max_size: int = SLOT_SEARCH_CACHE_SIZE, ttl: float = SLOT_SEARCH_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[float, int, list, int]]" = OrderedDict()
+
+    def put(self, user_id: int, candidates: list, total: int) -> str:
+        search_id = secrets.token_urlsafe(9)
+        with self._lock:
+            self._entries[search_id] = (time.monotonic() + self.ttl, user_id, candidates, total)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return search_id
+
+    def get(self, search_id: str, user_id: int) -> tuple[list, int]:
+        with self._lock:
+            entry = self._entries.get(search_id)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[search_id]
+                entry = None
+            if entry is None or entry[1] != user_id:
+                raise CursorExpired(search_id)
+            self._entries.move_to_end(search_id)
+            return entry[2], entry[3]
+
+_searches = _SearchCache()
+
+def _parse_exclusions(exclude_times, start_day: date, end_day: date) -> List[datetime]:
+    result = []
+    for value in exclude_times or []:
+        if not isinstance(value, str):
+            continue
+        try:
+            if "T" in value or "-" in value:
+                result.append(to_local_naive(datetime.fromisoformat(value)))
+            elif ":" in value:
+                t = datetime.strptime(value, "%H:%M").time()
+                day = start_day
+                while day <= end_day:
+                    result.append(datetime.combine(day, t))
+                    day += timedelta(days=1)
+        except ValueError:
+            continue
+    return sorted(result)
+
+def _near(sorted_times: List[datetime], candidate: datetime) -> bool:
+    i = bisect_left(sorted_times, candidate)
+    return any(
+        abs((candidate - sorted_times[j]).total_seconds()) < SLOT_STEP_MINUTES * 60
+        for j in (i - 1, i) if 0 <= j < len(sorted_times)
+    )
+
+def score_slot(candidate: datetime, end: datetime, start_day: date, preferred: set, priority: str,
+               index: AvailabilityIndex) -> tuple[float, list]:
+    score = 0.0
+    reasons = []
+
+    if candidate.hour in preferred and candidate.minute == 0:
+        score += 3.0
+        reasons.append("предпочтительное время для такого типа задач")
+
+    target_hour = _PRIORITY_TARGET_HOUR.get(priority, 15)
+    distance = abs(candidate.hour + candidate.minute / 60 - target_hour)
+    score += max(0.0, 2.0 - distance / 3)
+    if distance <= 1:
+        reasons.append("близко к удобному времени для приоритета " + priority)
+
+    days_out = (candidate.date() - start_day).days
+    score -= days_out * (1.0 if priority == "high" else 0.3)
+    if days_out == 0:
+        reasons.append("в первый день диапазона")
+
+    margin = timedelta(minutes=SLOT_STEP_MINUTES)
+    if index.is_free(candidate - margin, candidate) and index.is_free(end, end + margin):
+        score += 0.5
+        reasons.append("свободно до и после")
+
+    return round(score, 2), reasons
+
+def candidate_starts(index: AvailabilityIndex, start_day: date, end_day: date, duration: timedelta,
+                     hours: WorkingHours = DEFAULT_HOURS, now: Optional[datetime] = None) -> Iterator[datetime]:
+    now = now or datetime.now()
+    step = timedelta(minutes=SLOT_STEP_MINUTES)
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day + timedelta(days=1), datetime.min.time())
+    for slot_start, slot_end in index.free_slots(max(range_start, now), range_end, duration, hours):
+        minute = slot_start.minute % SLOT_STEP_MINUTES
+        current = slot_start if minute == 0 and not slot_start.second and not slot_start.microsecond else (
+            slot_start.replace(second=0, microsecond=0) + timedelta(minutes=SLOT_STEP_MINUTES - minute)
+        )
+        while current + duration <= slot_end:
+            yield current
+            current += step
+
+def rank_slots(
+    events,
+    start_day: date,
+    end_day: date,
+    description: str = "",
+    priority: str = "medium",
+    duration: timedelta = timedelta(minutes=SLOT_STEP_MINUTES),
+    hours: WorkingHours = DEFAULT_HOURS,
+    exclude_times=None,
+) -> tuple[list, int]:
+    index = AvailabilityIndex(events, hours.buffer_minutes)
+    preferred = set(TIME_PREFS_BY_CATEGORY[time_category(description)])
+    exclusions = _parse_exclusions(exclude_times, start_day, end_day)
+
+    candidates = []
+    for current in candidate_starts(index, start_day, end_day, duration, hours):
+        if _near(exclusions, current):
+            continue
+        end = current + duration
+        score, reasons = score_slot(current, end, start_day, preferred, priority, index)
+        candidates.append({"start": current, "end": end, "score": score, "reasons": reasons})
+
+    top = heapq.nsmallest(SLOT_SEARCH_MAX_CANDIDATES, candidates, key=lambda c: (-c["score"], c["start"]))
+    return top, len(candidates)
+
+def events_in_range(db, user_id: int, start_day: date, end_day: date):
+    from backend.database import Event
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day + timedelta(days=1), datetime.min.time())
+    return db.query(Event.start_time, Event.end_time).filter(
+        Event.user_id == user_id,
+        Event.start_time >= range_start - timedelta(days=1),
+        Event.start_time < range_end
+    ).all()
+
+def _page(search_id: str, candidates: list, total: int, offset: int, limit: int) -> dict:
+    items = candidates[offset:offset + limit]
+    next_offset = offset + len(items)
+    return {
+        "candidates": [
+            {
+                "start": c["start"].isoformat(timespec="minutes"),
+                "end": c["end"].isoformat(timespec="minutes"),
+                "score": c["score"],
+                "reasons": c["reasons"],
+            }
+            for c in items
+        ],
+        "total": total,
+        "next_cursor": f"{search_id}:{next_offset}" if next_offset < len(candidates) else None,
+    }
+
+def search_slots(
+    db,
+    user_id: int,
+    start_day: date,
+    end_day: Optional[date] = None,
+    description: str = "",
+    priority: str = "medium",
+    duration_minutes: int = SLOT_STEP_MINUTES,
+    exclude_times=None,
+    limit: int = 10,
+    hours: Optional[WorkingHours] = None,
+) -> dict:
+    end_day = end_day or start_day
+    if end_day < start_day:
+        raise ValueError("date_to is before date_from")
+    if (end_day - start_day).days >= SLOT_SEARCH_MAX_DAYS:
+        raise ValueError(f"range is limited to {SLOT_SEARCH_MAX_DAYS} days")
+
+    hours = hours or working_hours_for(db, user_id)
+    candidates, total = rank_slots(
+        events_in_range(db, user_id, start_day, end_day),
+        start_day,
+        end_day,
+        description,
+        priority,
+        timedelta(minutes=max(SLOT_STEP_MINUTES, duration_minutes)),
+        hours,
+        exclude_times,
+    )
+    search_id = _searches.put(user_id, candidates, total)
+    return _page(search_id, candidates, total, 0, limit)
+
+def next_page(user_id: int, cursor: str, limit: int = 10) -> dict:
+    try:
+        search_id, offset = cursor.rsplit(":", 1)
+        offset = int(offset)
+    except ValueError:
+        raise CursorExpired(cursor)
+    candidates, total = _searches.get(search_id, user_id)
+    return _page(search_id, candidates, total, max(0, offset), limit)
@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from backend.google_calendar import push_event_changes, sync_google_calendar
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+SYNC_DEBOUNCE_SECONDS = float(os.getenv("SYNC_DEBOUNCE_SECONDS", "2.0"))
+SYNC_MAX_DELAY_SECONDS = float(os.getenv("SYNC_MAX_DELAY_SECONDS", "10.0"))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "2"))
+SYNC_MAX_RETRIES = int(os.getenv("SYNC_MAX_RETRIES", "5"))
+SYNC_RETRY_BASE_SECONDS = float(os.getenv("SYNC_RETRY_BASE_SECONDS", "5.0"))
+SYNC_RETRY_MAX_SECONDS = float(os.getenv("SYNC_RETRY_MAX_SECONDS", "300.0"))
+
+@dataclass
+class _SyncJob:
+    user_id: int
+    enqueued_at: float
+    due_at: float
+    upsert_event_ids: set = field(default_factory=set)
+    delete_external_ids: set = field(default_factory=set)
+    requests: int = 1
+    attempts: int = 0
+
+class SyncScheduler:
+    def __init__(self, debounce: float = SYNC_DEBOUNCE_SECONDS, max_delay: float = SYNC_MAX_DELAY_SECONDS,
+                 workers: int = SYNC_WORKERS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.workers = max(1, workers)
+
+        self._cond = threading.Condition()
+        self._pending: dict[int, _SyncJob] = {}
+        self._running: set[int] = set()
+        self._threads: list[threading.Thread] = []
+        self._stopping = False
+
+        self._enqueued = 0
+        self._coalesced = 0
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._dropped = 0
+        self._latencies: deque = deque(maxlen=500)
+        self._durations: deque = deque(maxlen=500)
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"google-sync-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def request_sync(
+        self,
+        user_id: int,
+        upsert_event_ids: Iterable[int] = (),
+        delete_external_ids: Iterable[str] = (),
+        delay: Optional[float] = None,
+    ):
+        now = time.monotonic()
+        delay = self.debounce if delay is None else delay
+
+        with self._cond:
+            self._enqueued += 1
+            job = self._pending.get(user_id)
+            if job is None:
+                job = _SyncJob(user_id=user_id, enqueued_at=now, due_at=now + delay)
+                self._pending[user_id] = job
+            else:
+                self._coalesced += 1
+                job.requests += 1
+                if now + delay < job.due_at and delay < self.debounce:
+                    job.due_at = now + delay
+                else:
+                    job.due_at = min(max(job.due_at, now + delay), job.enqueued_at + self.max_delay)
+
+            job.upsert_event_ids.update(i for i in upsert_event_ids if i is not None)
+            job.delete_external_ids.update(g for g in delete_external_ids if g)
+            self._cond.notify()
+
+        if not self._threads:
+            self.start()
+
+    def _next_job(self) -> Optional[_SyncJob]:
+        with self._cond:
+            while not self._stopping:
+                now = time.monotonic()
+                ready = None
+                wait = None
+                for job in self._pending.values():
+                    if job.user_id in self._running:
+                        continue
+                    if job.due_at <= now:
+                        if ready is None or job.due_at < ready.due_at:
+                            ready = job
+                    else:
+                        wait = job.due_at - now if wait is None else min(wait, job.due_at - now)
+
+                if ready is not None:
+                    del self._pending[ready.user_id]
+                    self._running.add(ready.user_id)
+                    return ready
+
+                self._cond.wait(wait)
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            started = time.monotonic()
+            ok = True
+            try:
+                if job.upsert_event_ids or job.delete_external_ids:
+                    ok = push_event_changes(job.user_id, job.upsert_event_ids, job.delete_external_ids)
+                if ok:
+                    ok = sync_google_calendar(job.user_id)
+            except Exception as exc:
+                ok = False
+                logger.exception("Google sync for user %s failed: %s", job.user_id, exc)
+            finished = time.monotonic()
+
+            with self._cond:
+                self._running.discard(job.user_id)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                    self._retry_locked(job, finished)
+                self._latencies.append(finished - job.enqueued_at)
+                self._durations.append(finished - started)
+                self._cond.notify_all()
+
+    def _retry_locked(self, job: _SyncJob, now: float):
+        if job.attempts >= SYNC_MAX_RETRIES:
+            self._dropped += 1
+            logger.error("Google sync for user %s gave up after %s attempts, dropping %s upserts and %s deletes",
+                         job.user_id, job.attempts + 1, len(job.upsert_event_ids), len(job.delete_external_ids))
+            return
+
+        self._retried += 1
+        attempts = job.attempts + 1
+        pending = self._pending.get(job.user_id)
+        if pending is None:
+            backoff = min(SYNC_RETRY_BASE_SECONDS * 2 ** job.attempts, SYNC_RETRY_MAX_SECONDS)
+            pending = _SyncJob(user_id=job.user_id, enqueued_at=now, due_at=now + backoff, attempts=attempts)
+            self._pending[job.user_id] = pending
+        else:
+            pending.attempts = max(pending.attempts, attempts)
+        pending.upsert_event_ids.update(job.upsert_event_ids)
+        pending.delete_external_ids.update(job.delete_external_ids)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            latencies = sorted(self._latencies)
+            durations = sorted(self._durations)
+            oldest = min((j.enqueued_at for j in self._pending.values()), default=None)
+            return {
+                "queue_depth": len(self._pending),
+                "running": len(self._running),
+                "workers": len(self._threads),
+                "enqueued": self._enqueued,
+                "coalesced": self._coalesced,
+                "completed": self._completed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "dropped": self._dropped,
+                "oldest_pending_s": round(now - oldest, 3) if oldest is not None else None,
+                "latency_p50_s": _percentile(latencies, 0.50),
+                "latency_p95_s": _percentile(latencies, 0.95),
+                "sync_duration_p50_s": _percentile(durations, 0.50),
+                "sync_duration_p95_s": _percentile(durations, 0.95),
+            }
+
+def _percentile(values: list, q: float) -> Optional[float]:
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return round(values[idx], 3)
+
+sync_scheduler = SyncScheduler()
@@ -0,0 +1,193 @@
+import os
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
+
+try:
+    from backend.classifier import KeywordScanner, keyword_stem, normalize
+except Exception:
+    from classifier import KeywordScanner, keyword_stem, normalize
+
+TAXONOMY_CACHE_SIZE = int(os.getenv("TAXONOMY_CACHE_SIZE", "8192"))
+
+CATEGORIES = ["Работа", "Учеба", "Личное", "Здоровье", "Покупки", "Встречи"]
+DEFAULT_CATEGORY = "Личное"
+PRIORITIES = {"high", "medium", "low"}
+
+CATEGORY_KEYWORDS = {
+    "Работа": [
+        "работа", "проект", "встреча", "совещание", "бизнес", "офис", "коллеги", "начальник",
+        "отчет", "презентация", "дедлайн", "задача", "клиент", "контракт", "переговоры",
+    ],
+    "Учеба": [
+        "учеба", "урок", "экзамен", "лекция", "домашнее задание", "контрольная", "семинар",
+        "курс", "обучение", "школа", "университет", "студент", "преподаватель", "учитель",
+        "занятие", "пары",
+    ],
+    "Здоровье": [
+        "врач", "больница", "аптека", "здоровье", "мед", "прием", "осмотр", "анализ",
+        "спорт", "тренировка", "бег", "фитнес", "зал", "массаж", "стоматолог", "терапевт",
+        "поликлиника",
+    ],
+    "Покупки": [
+        "купить", "магазин", "покупки", "шопинг", "товары", "продукты", "супермаркет",
+        "аптека", "одежда", "еда", "заказать", "доставка",
+    ],
+    "Встречи": [
+        "встреча", "друг", "друзья", "семья", "родители", "дети", "поход", "кафе",
+        "кино", "театр", "концерт", "праздник", "день рождения", "свидание",
+    ],
+    "Личное": [
+        "личное", "дом", "быт", "уборка", "стирка", "ремонт", "счета", "платежи",
+        "документы", "паспорт", "банк", "почта", "звонок",
+    ],
+}
+
+CATEGORY_HINTS = {
+    "работ": "Работа",
+    "собеседован": "Работа",
+    "учеб": "Учеба",
+    "школ": "Учеба",
+    "унив": "Учеба",
+    "мед": "Здоровье",
+    "врач": "Здоровье",
+    "здоров": "Здоровье",
+    "куп": "Покупки",
+    "магазин": "Покупки",
+    "встреч": "Встречи",
+    "встрет": "Встречи",
+    "семья": "Личное",
+    "мама": "Личное",
+    "папа": "Личное",
+    "документ": "Личное",
+}
+
+PRIORITY_WORDS = (
+    ("high", ["срочно", "важно", "критично", "очень надо", "!!!"]),
+    ("low", ["не срочно", "когда будет время", "может быть"]),
+)
+
+TIME_PREFS_BY_CATEGORY = {
+    "work": [9, 10, 11, 14, 15, 16],
+    "lunch": [12, 13, 14],
+    "sport": [7, 8, 18, 19, 20],
+    "health": [9, 10, 11, 17, 18],
+    "shopping": [11, 12, 17, 18, 19],
+    "personal": [10, 11, 17, 18, 19],
+}
+
+TIME_CATEGORY_WORDS = (
+    ("work", ["встреча", "совещание", "митинг", "meeting", "работа", "проект", "бизнес"]),
+    ("lunch", ["обед", "перерыв", "пауза", "кушать", "поесть"]),
+    ("sport", ["спорт", "тренировка", "бег", "фитнес", "зал", "пробежка"]),
+    ("health", ["врач", "больница", "аптека", "здоровье", "мед"]),
+    ("shopping", ["купить", "магазин", "покупки", "шопинг"]),
+)
+
+ACTIVITY_NORMALIZATION = {
+    "плавание": "Плавание",
+    "плавать": "Плавание",
+    "плыть": "Плавание",
+    "бег": "Бег",
+    "бегать": "Бег",
+    "тренировка": "Тренировка",
+    "спорт": "Спорт",
+}
+
+ACTIVITY_VERB_TITLES = {
+    "плав": "Плавание",
+    "плы": "Плавание",
+    "бег": "Бег",
+    "тренир": "Тренировка",
+    "спорт": "Спорт",
+    "куп": "Покупки",
+}
+
+ACTIVITY_CATEGORIES = {
+    "плав": "Здоровье",
+    "бег": "Здоровье",
+    "тренир": "Здоровье",
+    "спорт": "Здоровье",
+    "йог": "Здоровье",
+    "куп": "Покупки",
+    "встр": "Встречи",
+    "работ": "Работа",
+    "учеб": "Учеба",
+}
+
+class TextProfile(NamedTuple):
+    category: str
+    hint: Optional[str]
+    priority: str
+    time_category: str
+
+_CATEGORY_NAMES = list(CATEGORY_KEYWORDS)
+_HINTS = list(CATEGORY_HINTS.items())
+_PRIORITY_NAMES = [priority for priority, _ in PRIORITY_WORDS]
+_TIME_NAMES = [name for name, _ in TIME_CATEGORY_WORDS]
+_UNRANKED = 1 << 30
+
+def _build_roles() -> Dict[str, list]:
+    roles: Dict[str, list] = {}
+
+    def role(key: str) -> list:
+        return roles.setdefault(key, [(), _UNRANKED, _UNRANKED, _UNRANKED])
+
+    for i, words in enumerate(CATEGORY_KEYWORDS.values()):
+        for word in words:
+            entry = role(keyword_stem(word))
+            if i not in entry[0]:
+                entry[0] += (i,)
+    for i, (key, _) in enumerate(_HINTS):
+        entry = role(normalize(key))
+        entry[1] = min(entry[1], i)
+    for slot, table in ((2, PRIORITY_WORDS), (3, TIME_CATEGORY_WORDS)):
+        for i, (_, words) in enumerate(table):
+            for word in words:
+                entry = role(normalize(word))
+                entry[slot] = min(entry[slot], i)
+    return roles
+
+_KEY_ROLES = _build_roles()
+_scanner = KeywordScanner(_KEY_ROLES)
+
+@lru_cache(maxsize=TAXONOMY_CACHE_SIZE)
+def _profile(text: str) -> TextProfile:
+    scores = [0] * len(_CATEGORY_NAMES)
+    hint = priority = time_rank = _UNRANKED
+    for key, (count, bounded) in _scanner.scan(text).items():
+        owners, hint_rank, priority_rank, key_time_rank = _KEY_ROLES[key]
+        for i in owners:
+            scores[i] += count + (2 if bounded else 0)
+        if hint_rank < hint:
+            hint = hint_rank
+        if priority_rank < priority:
+            priority = priority_rank
+        if key_time_rank < time_rank:
+            time_rank = key_time_rank
+
+    best = max(scores)
+    return TextProfile(
+        category=_CATEGORY_NAMES[scores.index(best)] if best > 0 else DEFAULT_CATEGORY,
+        hint=_HINTS[hint][1] if hint < _UNRANKED else None,
+        priority=_PRIORITY_NAMES[priority] if priority < _UNRANKED else "medium",
+        time_category=_TIME_NAMES[time_rank] if time_rank < _UNRANKED else "personal",
+    )
+
+def profile(text: str) -> TextProfile:
+    return _profile(normalize(text))
+
+def _first_match(mapping: Dict[str, str], text: str) -> Optional[str]:
+    for key, value in mapping.items():
+        if key in text:
+            return value
+    return None
+
+def activity_title(verb: str) -> Optional[str]:
+    return _first_match(ACTIVITY_VERB_TITLES, verb)
+
+def activity_category(title: str) -> Optional[str]:
+    return _first_match(ACTIVITY_CATEGORIES, title.lower())
+
+def cache_stats() -> dict:
+    info = _profile.cache_info()
+    return {"size": info.currsize, "hits": info.hits, "misses": info.misses}
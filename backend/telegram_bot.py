@@ -1,14 +1,22 @@
 import os
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from sqlalchemy.orm import Session
 from backend.database import get_db, Event, get_user_creds, save_user_creds, ensure_user_exists
-from backend.ai import ask_gigachat, auto_assign_category
-from backend.google_calendar import sync_google_calendar, upsert_google_event
-from backend.ai import suggest_optimal_time_with_exclusions
+from backend.ai import ask_gigachat_async, auto_assign_categories, auto_assign_category
+from backend.ai_client import aclose as close_gigachat_client
+from backend.ai_parser import warmup as warmup_parser
+from backend.google_calendar import sync_google_calendar
+from backend.sync_worker import sync_scheduler
+from backend.availability import working_hours_for
+from backend.slot_search import CursorExpired, next_page, search_slots
+from backend.batch_scheduler import commit_plan
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,23 +27,28 @@ if not TELEGRAM_BOT_TOKEN:
 
 pending_proposals: Dict[int, Dict[str, Any]] = {}
 
+MAX_SLOT_CURSORS = 1000
+slot_cursors: "OrderedDict[tuple, str]" = OrderedDict()
+slot_cursors_lock = threading.Lock()
+
 def get_user_id_from_update(update: Update) -> int:
     return update.effective_user.id
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "Привет! Я Помняша, ИИ-ассистент для планирования.\n"
-        "Пиши свои задачи — помогу всё разложить по времени!\n\n"
-        "Команды:\n"
-        "/events - показать события\n"
-        "/stats - статистика\n"
-        "/sync - синхронизировать с Google Calendar"
+def _day_bounds(target_date):
+    return (
+        datetime.combine(target_date, datetime.min.time()),
+        datetime.combine(target_date + timedelta(days=1), datetime.min.time()),
     )
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id_from_update(update)
-    msg = update.message.text
+def _events_on(db: Session, user_id: int, target_date):
+    start_dt, end_dt = _day_bounds(target_date)
+    return db.query(Event).filter(
+        Event.user_id == user_id,
+        Event.start_time >= start_dt,
+        Event.start_time < end_dt
+    ).order_by(Event.start_time).all()
 
+def _backfill_categories(user_id: int):
     ensure_user_exists(user_id)
     db = next(get_db())
     try:
@@ -44,14 +57,190 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             (Event.view.is_(None) | (Event.view == ""))
         ).limit(10).all()
 
-        for event in events_without_category:
-            category = auto_assign_category(event.title or "", event.description or "")
+        categories = auto_assign_categories((event.title, event.description) for event in events_without_category)
+        for event, category in zip(events_without_category, categories):
             event.view = category
 
         if events_without_category:
             db.commit()
     except Exception:
         db.rollback()
+    finally:
+        db.close()
+
+def _day_schedule_text(user_id: int, target_date) -> str:
+    db = next(get_db())
+    try:
+        day_events = _events_on(db, user_id, target_date)
+        if not day_events:
+            return f"На {target_date.strftime('%d.%m.%Y')} у тебя пока нет запланированных событий."
+        parts = []
+        for ev in day_events:
+            t = ev.start_time.strftime("%H:%M")
+            label = f" ({ev.view})" if getattr(ev, 'view', None) else ""
+            parts.append(f"{t} — {ev.title}{label}")
+        return f"На {target_date.strftime('%d.%m.%Y')} у тебя {len(day_events)} событ.\n" + "\n".join(parts)
+    finally:
+        db.close()
+
+def _proposal_datetime(user_id: int, processed: dict, date_str: str, time_str, title: str) -> datetime:
+    if time_str:
+        return datetime.fromisoformat(f"{date_str}T{time_str}")
+
+    from backend.ai import suggest_optimal_time
+    target_date = datetime.fromisoformat(date_str).date()
+    db = next(get_db())
+    try:
+        existing_events = _events_on(db, user_id, target_date)
+        hours = working_hours_for(db, user_id)
+    finally:
+        db.close()
+
+    suggested_time = suggest_optimal_time(
+        target_date, title, existing_events, processed.get("priority", "medium"), hours=hours
+    )
+    return suggested_time or datetime.fromisoformat(f"{date_str}T15:00")
+
+def _create_event(user_id: int, title: str, description: str, event_datetime: datetime, category: str) -> int:
+    ensure_user_exists(user_id)
+    db = next(get_db())
+    try:
+        new_event = Event(
+            user_id=user_id,
+            title=title,
+            description=description,
+            start_time=event_datetime,
+            end_time=event_datetime,
+            source="ai_assistant",
+            view=category
+        )
+        db.add(new_event)
+        db.commit()
+        db.refresh(new_event)
+        event_id = new_event.id
+    finally:
+        db.close()
+
+    sync_scheduler.request_sync(user_id, upsert_event_ids=[event_id], delay=0)
+    return event_id
+
+def _commit_batch(user_id: int, plan: list):
+    ensure_user_exists(user_id)
+    db = next(get_db())
+    try:
+        return commit_plan(db, user_id, plan, delay=0)
+    finally:
+        db.close()
+
+def _batch_result_text(event_ids: list, skipped: list) -> str:
+    text = f"✅ Добавлено событий: {len(event_ids)}"
+    if skipped:
+        text += "\nПропущены из-за пересечений: " + ", ".join(item["title"] for item in skipped)
+    return text
+
+def _suggest_other_time(user_id: int, target_date, title: str, exclude_times: list):
+    key = (user_id, target_date, title)
+    page = None
+    with slot_cursors_lock:
+        cursor = slot_cursors.pop(key, None)
+    if cursor:
+        try:
+            page = next_page(user_id, cursor, limit=1)
+        except CursorExpired:
+            page = None
+
+    if page is None:
+        ensure_user_exists(user_id)
+        db = next(get_db())
+        try:
+            page = search_slots(db, user_id, target_date, target_date, description=title,
+                                exclude_times=exclude_times, limit=1)
+        finally:
+            db.close()
+
+    if page["next_cursor"]:
+        with slot_cursors_lock:
+            slot_cursors[key] = page["next_cursor"]
+            while len(slot_cursors) > MAX_SLOT_CURSORS:
+                slot_cursors.popitem(last=False)
+
+    if not page["candidates"]:
+        return None
+    return datetime.fromisoformat(page["candidates"][0]["start"])
+
+def _drop_slot_cursors(user_id: int):
+    with slot_cursors_lock:
+        for key in [k for k in slot_cursors if k[0] == user_id]:
+            del slot_cursors[key]
+
+def _events_text(user_id: int):
+    ensure_user_exists(user_id)
+    db = next(get_db())
+    try:
+        events = db.query(Event).filter(Event.user_id == user_id).order_by(Event.start_time).limit(10).all()
+        if not events:
+            return None
+
+        text = "Твои события:\n\n"
+        for ev in events:
+            date_str = ev.start_time.strftime("%d.%m.%Y")
+            time_str = ev.start_time.strftime("%H:%M")
+            label = f" [{ev.view}]" if getattr(ev, 'view', None) else ""
+            text += f"{date_str} {time_str} — {ev.title}{label}\n"
+        return text
+    finally:
+        db.close()
+
+def _stats_text(user_id: int) -> str:
+    ensure_user_exists(user_id)
+    db = next(get_db())
+    try:
+        events = db.query(Event).filter(Event.user_id == user_id).all()
+
+        category_stats = {}
+        day_stats = {i: 0 for i in range(7)}
+
+        for event in events:
+            category = getattr(event, 'view', None) or 'Личное'
+            if not category or category == '':
+                category = auto_assign_category(event.title or '', event.description or '')
+                try:
+                    event.view = category
+                except Exception:
+                    pass
+            category_stats[category] = category_stats.get(category, 0) + 1
+            day_stats[event.start_time.weekday()] += 1
+
+        db.commit()
+
+        day_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+        text = f"Статистика ({len(events)} событий):\n\n"
+        text += "По категориям:\n"
+        for cat, count in sorted(category_stats.items(), key=lambda x: x[1], reverse=True):
+            text += f"{cat}: {count}\n"
+
+        text += "\nПо дням недели:\n"
+        for i, day_name in enumerate(day_names):
+            text += f"{day_name}: {day_stats[i]}\n"
+        return text
+    finally:
+        db.close()
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Привет! Я Помняша, ИИ-ассистент для планирования.\n"
+        "Пиши свои задачи — помогу всё разложить по времени!\n\n"
+        "Команды:\n"
+        "/events - показать события\n"
+        "/stats - статистика\n"
+        "/sync - синхронизировать с Google Calendar"
+    )
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = get_user_id_from_update(update)
+    msg = update.message.text
+
+    await asyncio.to_thread(_backfill_categories, user_id)
 
     msg_norm = (msg or '').strip().lower()
     short_accepts = {'да', 'давай', 'ок', 'окей', 'хорошо', 'согласен', 'согласна'}
@@ -78,25 +267,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     except Exception:
                         pass
 
-            start_dt = datetime.combine(target_date, datetime.min.time())
-            end_dt = datetime.combine(target_date + timedelta(days=1), datetime.min.time())
-
-            day_events = db.query(Event).filter(
-                Event.user_id == user_id,
-                Event.start_time >= start_dt,
-                Event.start_time < end_dt
-            ).order_by(Event.start_time).all()
-
-            if not day_events:
-                text = f"На {target_date.strftime('%d.%m.%Y')} у тебя пока нет запланированных событий."
-            else:
-                parts = []
-                for ev in day_events:
-                    t = ev.start_time.strftime("%H:%M")
-                    label = f" ({ev.view})" if getattr(ev, 'view', None) else ""
-                    parts.append(f"{t} — {ev.title}{label}")
-                text = f"На {target_date.strftime('%d.%m.%Y')} у тебя {len(day_events)} событ.\n" + "\n".join(parts)
-
+            text = await asyncio.to_thread(_day_schedule_text, user_id, target_date)
             await update.message.reply_text(text)
             return
     except Exception:
@@ -104,6 +275,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if msg_norm in short_accepts:
         proposal = pending_proposals.get(user_id)
+        if isinstance(proposal, dict) and proposal.get('type') == 'batch_proposal':
+            try:
+                event_ids, skipped = await asyncio.to_thread(_commit_batch, user_id, proposal['plan']['plan'])
+                pending_proposals.pop(user_id, None)
+                await update.message.reply_text(_batch_result_text(event_ids, skipped))
+            except Exception as e:
+                await update.message.reply_text(f"Ошибка при создании событий: {e}")
+            return
         if proposal and isinstance(proposal, dict):
             try:
                 processed = proposal.get('processed_task') or proposal
@@ -115,66 +294,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await update.message.reply_text("Не удалось определить дату для события.")
                     return
 
-                ensure_user_exists(user_id)
-                if not time_str:
-                    from backend.ai import suggest_optimal_time
-                    target_date = datetime.fromisoformat(date_str).date()
-                    existing_events = db.query(Event).filter(
-                        Event.user_id == user_id,
-                        Event.start_time >= datetime.combine(target_date, datetime.min.time()),
-                        Event.start_time < datetime.combine(target_date + timedelta(days=1), datetime.min.time()),
-                    ).all()
-
-                    suggested_time = suggest_optimal_time(
-                        target_date, title, existing_events, processed.get("priority", "medium")
-                    )
-
-                    if suggested_time:
-                        event_datetime = suggested_time
-                    else:
-                        event_datetime = datetime.fromisoformat(f"{date_str}T15:00")
-                else:
-                    event_datetime = datetime.fromisoformat(f"{date_str}T{time_str}")
-
-                new_event = Event(
-                    user_id=user_id,
-                    title=title,
-                    description=processed.get('description') or title,
-                    start_time=event_datetime,
-                    end_time=event_datetime,
-                    source="ai_assistant",
-                    view=processed.get('category') or auto_assign_category(title, processed.get('description') or "")
+                event_datetime = await asyncio.to_thread(_proposal_datetime, user_id, processed, date_str, time_str, title)
+                await asyncio.to_thread(
+                    _create_event, user_id, title, processed.get('description') or title, event_datetime,
+                    processed.get('category') or auto_assign_category(title, processed.get('description') or "")
                 )
 
-                db.add(new_event)
-                db.commit()
-                db.refresh(new_event)
-
-                try:
-                    gid = upsert_google_event(user_id, new_event)
-                    if gid:
-                        new_event.external_id = gid
-                        new_event.source = "google"
-                        db.commit()
-                except Exception:
-                    pass
-
-                try:
-                    sync_google_calendar(user_id)
-                except Exception:
-                    pass
-
-                del pending_proposals[user_id]
+                pending_proposals.pop(user_id, None)
+                _drop_slot_cursors(user_id)
                 await update.message.reply_text(f"✅ Событие '{title}' добавлено на {event_datetime.strftime('%d.%m.%Y %H:%M')}")
                 return
             except Exception as e:
                 await update.message.reply_text(f"Ошибка при создании события: {e}")
                 return
 
-    result = ask_gigachat(msg, db_session=db, user_id=user_id)
+    result = await ask_gigachat_async(msg, user_id=user_id)
 
     try:
-        if isinstance(result, dict) and result.get('type') == 'proposal' and result.get('needs_confirmation'):
+        if isinstance(result, dict) and result.get('type') in ('proposal', 'batch_proposal') and result.get('needs_confirmation'):
             pending_proposals[user_id] = result
     except Exception:
         pass
@@ -195,6 +332,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             text = result.get('content', f"Предлагаю добавить: '{title}' на {date_str} {time_str}")
             await update.message.reply_text(text, reply_markup=reply_markup)
+        elif result.get('type') == 'batch_proposal':
+            keyboard = [
+                [InlineKeyboardButton("✅ Добавить всё", callback_data=f"batch_confirm_{user_id}")],
+                [InlineKeyboardButton("❌ Отмена", callback_data=f"cancel_{user_id}")]
+            ]
+            await update.message.reply_text(result['content'], reply_markup=InlineKeyboardMarkup(keyboard))
         elif result.get('type') == 'text':
             await update.message.reply_text(result.get('content', 'Не удалось обработать запрос'))
         else:
@@ -202,8 +345,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(str(result))
 
-    db.close()
-
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -211,63 +352,38 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     user_id = get_user_id_from_update(update)
 
-    if data.startswith("confirm_"):
+    if data.startswith("batch_confirm_"):
+        proposal = pending_proposals.get(user_id)
+        if not (isinstance(proposal, dict) and proposal.get('type') == 'batch_proposal'):
+            await query.edit_message_text("Предложение устарело, отправь задачи ещё раз")
+            return
+        try:
+            event_ids, skipped = await asyncio.to_thread(_commit_batch, user_id, proposal['plan']['plan'])
+            pending_proposals.pop(user_id, None)
+            await query.edit_message_text(_batch_result_text(event_ids, skipped))
+        except Exception as e:
+            await query.edit_message_text(f"Ошибка: {e}")
+
+    elif data.startswith("confirm_"):
         parts = data.split("_", 4)
         if len(parts) >= 5:
             _, _, date_str, time_str, title = parts
-            ensure_user_exists(user_id)
-            db = next(get_db())
             try:
                 event_datetime = datetime.fromisoformat(f"{date_str}T{time_str}")
                 category = auto_assign_category(title, title)
-
-                new_event = Event(
-                    user_id=user_id,
-                    title=title,
-                    description=title,
-                    start_time=event_datetime,
-                    end_time=event_datetime,
-                    source="ai_assistant",
-                    view=category
-                )
-
-                db.add(new_event)
-                db.commit()
-                db.refresh(new_event)
-
-                try:
-                    gid = upsert_google_event(user_id, new_event)
-                    if gid:
-                        new_event.external_id = gid
-                        new_event.source = "google"
-                        db.commit()
-                except Exception:
-                    pass
-
-                try:
-                    sync_google_calendar(user_id)
-                except Exception:
-                    pass
-
+                await asyncio.to_thread(_create_event, user_id, title, title, event_datetime, category)
+                pending_proposals.pop(user_id, None)
+                _drop_slot_cursors(user_id)
                 await query.edit_message_text(f"✅ Событие '{title}' добавлено на {event_datetime.strftime('%d.%m.%Y %H:%M')}")
             except Exception as e:
                 await query.edit_message_text(f"Ошибка: {e}")
-            finally:
-                db.close()
 
     elif data.startswith("other_time_"):
         parts = data.split("_", 3)
         if len(parts) >= 4:
             _, _, date_str, title = parts
-            ensure_user_exists(user_id)
-            db = next(get_db())
             try:
                 target_date = datetime.fromisoformat(date_str).date()
-                existing_events = db.query(Event).filter(
-                    Event.user_id == user_id,
-                    Event.start_time >= datetime.combine(target_date, datetime.min.time()),
-                    Event.start_time < datetime.combine(target_date + timedelta(days=1), datetime.min.time())
-                ).all()
 
                 exclude_times = []
                 if user_id in pending_proposals:
@@ -276,9 +392,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     if processed.get('time'):
                         exclude_times.append(processed.get('time'))
 
-                suggested_time = suggest_optimal_time_with_exclusions(
-                    target_date, title, existing_events, "medium", exclude_times
-                )
+                suggested_time = await asyncio.to_thread(_suggest_other_time, user_id, target_date, title, exclude_times)
 
                 if suggested_time:
                     time_str = suggested_time.strftime("%H:%M")
@@ -293,91 +407,59 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await query.edit_message_text("Нет свободного времени на эту дату")
             except Exception as e:
                 await query.edit_message_text(f"Ошибка: {e}")
-            finally:
-                db.close()
 
     elif data.startswith("cancel_"):
         if user_id in pending_proposals:
             del pending_proposals[user_id]
+        _drop_slot_cursors(user_id)
         await query.edit_message_text("Отменено")
 
 async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = get_user_id_from_update(update)
-    ensure_user_exists(user_id)
-    db = next(get_db())
     try:
-        events = db.query(Event).filter(Event.user_id == user_id).order_by(Event.start_time).limit(10).all()
-
-        if not events:
-            await update.message.reply_text("У тебя пока нет событий")
-            return
-
-        text = "Твои события:\n\n"
-        for ev in events:
-            date_str = ev.start_time.strftime("%d.%m.%Y")
-            time_str = ev.start_time.strftime("%H:%M")
-            label = f" [{ev.view}]" if getattr(ev, 'view', None) else ""
-            text += f"{date_str} {time_str} — {ev.title}{label}\n"
-
-        await update.message.reply_text(text)
+        text = await asyncio.to_thread(_events_text, user_id)
+        await update.message.reply_text(text or "У тебя пока нет событий")
     except Exception as e:
         await update.message.reply_text(f"Ошибка: {e}")
-    finally:
-        db.close()
 
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = get_user_id_from_update(update)
-    ensure_user_exists(user_id)
-    db = next(get_db())
     try:
-        events = db.query(Event).filter(Event.user_id == user_id).all()
-
-        category_stats = {}
-        day_stats = {i: 0 for i in range(7)}
-
-        for event in events:
-            category = getattr(event, 'view', None) or 'Личное'
-            if not category or category == '':
-                category = auto_assign_category(event.title or '', event.description or '')
-                try:
-                    event.view = category
-                except Exception:
-                    pass
-            category_stats[category] = category_stats.get(category, 0) + 1
-            day_stats[event.start_time.weekday()] += 1
-
-        db.commit()
-
-        day_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-        text = f"Статистика ({len(events)} событий):\n\n"
-        text += "По категориям:\n"
-        for cat, count in sorted(category_stats.items(), key=lambda x: x[1], reverse=True):
-            text += f"{cat}: {count}\n"
-
-        text += "\nПо дням недели:\n"
-        for i, day_name in enumerate(day_names):
-            text += f"{day_name}: {day_stats[i]}\n"
-
+        text = await asyncio.to_thread(_stats_text, user_id)
         await update.message.reply_text(text)
     except Exception as e:
         await update.message.reply_text(f"Ошибка: {e}")
-    finally:
-        db.close()
 
 async def sync_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = get_user_id_from_update(update)
     try:
-        sync_google_calendar(user_id)
-        await update.message.reply_text("✅ Синхронизация завершена")
+        if await asyncio.to_thread(sync_google_calendar, user_id):
+            await update.message.reply_text("✅ Синхронизация завершена")
+        else:
+            await update.message.reply_text("Ошибка синхронизации, попробуй позже")
     except Exception as e:
         await update.message.reply_text(f"Ошибка синхронизации: {e}")
 
+async def _on_startup(application: Application):
+    sync_scheduler.start()
+    await asyncio.to_thread(warmup_parser)
+
+async def _on_shutdown(application: Application):
+    await close_gigachat_client()
+    await asyncio.to_thread(sync_scheduler.stop)
+
 def run_bot():
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN not set, bot will not start")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("events", show_events))
@@ -0,0 +1,49 @@
+from datetime import date
+
+import pytest
+
+from backend import ai
+from backend.ai_parser import fast_parse_date, local_parse
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setattr(ai, "get_token", lambda: None)
+    ai.extraction_cache.clear()
+
+
+def _tier(text):
+    return ai.extract_task_via_gigachat(text)["processed_task"]["metadata"]["ai_model"]
+
+
+def test_date_and_activity_without_time_goes_past_local_tier():
+    local = local_parse("хочу сходить в кино завтра")
+    assert local["time"] is None
+    assert _tier("хочу сходить в кино завтра") != "local_parse"
+
+
+def test_day_month_token_is_not_read_as_time():
+    local = local_parse("купить цветы 12.03")
+    assert (local["date"].day, local["date"].month) == (12, 3)
+    assert local["time"] is None
+    assert not local["signals"]["time"]
+    assert _tier("купить цветы 12.03") != "local_parse"
+
+
+def test_date_and_time_stays_local():
+    local = local_parse("созвон завтра в 10:00")
+    assert local["time"].strftime("%H:%M") == "10:00"
+    assert _tier("созвон завтра в 10:00") == "local_parse"
+
+
+def test_bare_time_with_dot_is_not_a_date():
+    today = date(2026, 10, 16)
+    assert fast_parse_date("на 12.10 созвон", today) is None
+    assert fast_parse_date("встреча 5.10", today) is None
+    assert fast_parse_date("к 25.10 сдать отчет", today) == date(2026, 10, 25)
+    assert fast_parse_date("купить цветы 12.03", today) == date(2027, 3, 12)
+
+
+def test_in_months_uses_calendar_months():
+    assert fast_parse_date("через месяц", date(2026, 1, 31)) == date(2026, 2, 28)
+    assert fast_parse_date("через 2 месяца", date(2026, 10, 16)) == date(2026, 12, 16)
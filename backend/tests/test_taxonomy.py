@@ -0,0 +1,8 @@
+from backend.taxonomy import activity_category, activity_title
+
+
+def test_activity_lookups_follow_table_order_not_text_position():
+    assert activity_category("купить абонемент на плавание") == "Здоровье"
+    assert activity_title("купаться и плавать") == "Плавание"
+    assert activity_category("встреча по работе") == "Встречи"
+    assert activity_title("поспать") is None
@@ -0,0 +1,18 @@
+import threading
+
+from backend import telegram_bot
+
+
+def test_drop_slot_cursors_removes_only_that_user():
+    telegram_bot.slot_cursors.clear()
+    telegram_bot.slot_cursors[(1, "2026-10-17", "бег")] = "a:1"
+    telegram_bot.slot_cursors[(1, "2026-10-18", "бег")] = "b:1"
+    telegram_bot.slot_cursors[(2, "2026-10-17", "бег")] = "c:1"
+
+    worker = threading.Thread(target=telegram_bot._drop_slot_cursors, args=(1,), daemon=True)
+    worker.start()
+    worker.join(3)
+
+    assert not worker.is_alive()
+    assert list(telegram_bot.slot_cursors) == [(2, "2026-10-17", "бег")]
+    assert not telegram_bot.slot_cursors_lock.locked()